@@ -2,27 +2,30 @@
 import os
 import sqlite3
 import sys
+from functools import lru_cache
 from typing import List, Optional
 
 from core import (
     ENV_PATH,
     Message,
     add_memory,
-    add_message,
-    build_system_prompt,
-    call_openai,
+    add_messages_bulk,
+    build_prompt_messages,
     clear_memories,
+    close_db,
     connect_db,
     conversation_exists,
     create_conversation,
     create_user_message,
     delete_memory,
+    generate_response,
     get_conversation_title,
     get_recent_messages,
     init_db,
     list_conversations,
     list_memories,
     load_env_file,
+    prefetch_api_connection,
     update_conversation_title,
 )
 
@@ -31,30 +34,33 @@ ANSI_BOLD = "\033[1m"
 ANSI_BLUE = "\033[34m"
 ANSI_GREEN = "\033[32m"
 ANSI_DIM = "\033[2m"
+ANSI_BOLD_BLUE = ANSI_BOLD + ANSI_BLUE
+ANSI_BOLD_GREEN = ANSI_BOLD + ANSI_GREEN
 TEXT_FILE_EXTENSIONS = {".txt", ".md", ".csv", ".json", ".py", ".log"}
+CONVERSATIONS_PAGE_SIZE = 25
 
 
-def supports_color() -> bool:
-    return sys.stdout.isatty()
+_SUPPORTS_COLOR = sys.stdout.isatty()
 
 
-def style(text: str, *codes: str) -> str:
-    if not supports_color() or not codes:
+def style(text: str, code: str) -> str:
+    if not _SUPPORTS_COLOR:
         return text
-    return f"{''.join(codes)}{text}{ANSI_RESET}"
+    return f"{code}{text}{ANSI_RESET}"
 
 
+@lru_cache(maxsize=32)
 def format_prompt(conversation_id: str, title: Optional[str]) -> str:
     title_display = title or "Untitled"
     convo_short = conversation_id.split("-")[0]
     header = f"{title_display} · {convo_short}"
-    return style(f"\n{header}\nYou:", ANSI_BOLD, ANSI_BLUE) + " "
+    return style(f"\n{header}\nYou:", ANSI_BOLD_BLUE) + " "
 
 
 def print_banner(conversation_id: str, title: Optional[str]) -> None:
     title_display = title or "Untitled"
     banner = f"Chat ready · {title_display}"
-    print(style(banner, ANSI_BOLD, ANSI_GREEN))
+    print(style(banner, ANSI_BOLD_GREEN))
     print(style(f"Conversation: {conversation_id}", ANSI_DIM))
 
 
@@ -63,7 +69,7 @@ def print_help() -> None:
         """
 Commands:
   /new                      Start a new conversation.
-  /conversations            List saved conversations.
+  /conversations [cursor]   List saved conversations (newest first).
   /open <id>                Resume a conversation by id.
   /title <text>             Rename the current conversation.
   /memory add <text>        Add a long-term memory.
@@ -88,7 +94,7 @@ def print_recent_history(
         return
 
     shown = messages[-max(1, limit) :]
-    print(style("\nRecent messages:", ANSI_BOLD, ANSI_GREEN))
+    print(style("\nRecent messages:", ANSI_BOLD_GREEN))
     for message in shown:
         role_label = "You" if message.role == "user" else "Assistant"
         print(f"{role_label}: {message.content}")
@@ -105,7 +111,8 @@ def handle_memory_command(conn: sqlite3.Connection, args: List[str]) -> None:
         if not content:
             print("Usage: /memory add <text>")
             return
-        add_memory(conn, content)
+        with conn:
+            add_memory(conn, content)
         print("Memory saved.")
     elif action == "list":
         memories = list_memories(conn)
@@ -123,26 +130,46 @@ def handle_memory_command(conn: sqlite3.Connection, args: List[str]) -> None:
         except ValueError:
             print("Memory id must be a number.")
             return
-        if delete_memory(conn, mem_id):
+        with conn:
+            deleted = delete_memory(conn, mem_id)
+        if deleted:
             print("Memory deleted.")
         else:
             print("Memory not found.")
     elif action == "clear":
-        clear_memories(conn)
+        with conn:
+            clear_memories(conn)
         print("All memories cleared.")
     else:
         print("Unknown /memory action. Use add, list, delete, or clear.")
 
 
 def send_user_message(conn: sqlite3.Connection, conversation_id: str, user_message: Message, query: str) -> None:
+    try:
+        response_text = request_reply(conn, conversation_id, user_message, query)
+    except KeyboardInterrupt:
+        # Nothing is stored for a cancelled turn, so it can simply be retried.
+        print(style("Request cancelled.", ANSI_DIM))
+        return
+    add_messages_bulk(conn, conversation_id, [user_message, Message("assistant", response_text)])
+
+
+def request_reply(conn: sqlite3.Connection, conversation_id: str, user_message: Message, query: str) -> str:
+    prefetch_api_connection()
     history = get_recent_messages(conn, conversation_id)
-    system_prompt = build_system_prompt(conn, query)
-    messages = [Message("system", system_prompt), *history, user_message]
+    messages = build_prompt_messages(conn, history, user_message, query)
+
+    print("\nAssistant: ", end="", flush=True)
+    try:
+        # Cache writes commit with the reply, or roll back if it's cancelled.
+        with conn:
+            return generate_response(conn, conversation_id, messages, on_delta=print_delta)
+    finally:
+        print()
+
 
-    response_text = call_openai(messages)
-    add_message(conn, conversation_id, user_message)
-    add_message(conn, conversation_id, Message("assistant", response_text))
-    print(f"\nAssistant: {response_text}")
+def print_delta(delta: str) -> None:
+    print(delta, end="", flush=True)
 
 
 def main() -> int:
@@ -150,123 +177,132 @@ def main() -> int:
     conn = connect_db()
     init_db(conn)
 
-    conversation_id = create_conversation(conn)
-    current_title = get_conversation_title(conn, conversation_id)
+    with conn:
+        conversation_id, current_title = create_conversation(conn)
     print_banner(conversation_id, current_title)
     print("Type /help for commands.")
 
-    while True:
-        try:
-            user_input = input(format_prompt(conversation_id, current_title)).strip()
-        except (EOFError, KeyboardInterrupt):
-            print("\nExiting.")
-            break
+    try:
+        while True:
+            try:
+                user_input = input(format_prompt(conversation_id, current_title)).strip()
+            except (EOFError, KeyboardInterrupt):
+                print("\nExiting.")
+                break
 
-        if not user_input:
-            continue
+            if not user_input:
+                continue
 
-        if user_input.startswith("/"):
-            parts = user_input.split()
-            command = parts[0]
-            args = parts[1:]
+            if user_input.startswith("/"):
+                parts = user_input.split()
+                command = parts[0]
+                args = parts[1:]
 
-            if command == "/exit":
-                print("Goodbye.")
-                break
-            if command == "/help":
-                print_help()
-                continue
-            if command == "/new":
-                conversation_id = create_conversation(conn)
-                current_title = get_conversation_title(conn, conversation_id)
-                print_banner(conversation_id, current_title)
-                continue
-            if command == "/conversations":
-                conversations = list_conversations(conn)
-                if not conversations:
-                    print("No conversations found.")
+                if command == "/exit":
+                    print("Goodbye.")
+                    break
+                if command == "/help":
+                    print_help()
                     continue
-                for convo_id, title, created_at in conversations:
-                    title_display = title or "Untitled"
-                    print(f"{convo_id} | {title_display} | {created_at}")
-                continue
-            if command == "/open":
-                if not args:
-                    print("Usage: /open <id>")
-                    continue
-                target_id = args[0]
-                if conversation_exists(conn, target_id):
-                    conversation_id = target_id
-                    current_title = get_conversation_title(conn, conversation_id)
+                if command == "/new":
+                    with conn:
+                        conversation_id, current_title = create_conversation(conn)
                     print_banner(conversation_id, current_title)
-                    print_recent_history(conn, conversation_id, limit=10)
-                else:
-                    print("Conversation not found.")
-                continue
-            if command == "/title":
-                title = " ".join(args).strip()
-                if not title:
-                    print("Usage: /title <text>")
                     continue
-                if update_conversation_title(conn, conversation_id, title):
-                    current_title = title
-                    print("Title updated.")
-                else:
-                    print("Unable to update title.")
-                continue
-            if command == "/memory":
-                handle_memory_command(conn, args)
-                continue
-            if command == "/history":
-                limit = 10
-                if args:
-                    try:
-                        limit = int(args[0])
-                    except ValueError:
-                        print("Usage: /history [number]")
+                if command == "/conversations":
+                    before = args[0] if args else None
+                    conversations = list_conversations(
+                        conn, limit=CONVERSATIONS_PAGE_SIZE, before=before
+                    )
+                    if not conversations:
+                        print("No conversations found.")
                         continue
-                print_recent_history(conn, conversation_id, limit=limit)
-                continue
-            if command == "/image":
-                if not args:
-                    print("Usage: /image <path> [prompt]")
+                    for convo_id, title, created_at in conversations:
+                        title_display = title or "Untitled"
+                        print(f"{convo_id} | {title_display} | {created_at}")
+                    if len(conversations) == CONVERSATIONS_PAGE_SIZE:
+                        cursor = conversations[-1][2]
+                        print(style(f"…more (use /conversations {cursor})", ANSI_DIM))
                     continue
-                image_path = args[0]
-                prompt = " ".join(args[1:]).strip() or "Please analyze this image."
-                try:
-                    user_message = create_user_message(text=prompt, image_paths=[image_path])
-                    send_user_message(conn, conversation_id, user_message, prompt)
-                except Exception as exc:
-                    print(f"Error: {exc}")
-                continue
-            if command == "/file":
-                if not args:
-                    print("Usage: /file <path> [prompt]")
+                if command == "/open":
+                    if not args:
+                        print("Usage: /open <id>")
+                        continue
+                    target_id = args[0]
+                    if conversation_exists(conn, target_id):
+                        conversation_id = target_id
+                        current_title = get_conversation_title(conn, conversation_id)
+                        print_banner(conversation_id, current_title)
+                        print_recent_history(conn, conversation_id, limit=10)
+                    else:
+                        print("Conversation not found.")
                     continue
-                file_path = args[0]
-                ext = os.path.splitext(file_path)[1].lower()
-                if ext not in TEXT_FILE_EXTENSIONS:
-                    print("Only text-like files are supported via /file (.txt, .md, .csv, .json, .py, .log).")
+                if command == "/title":
+                    title = " ".join(args).strip()
+                    if not title:
+                        print("Usage: /title <text>")
+                        continue
+                    with conn:
+                        updated = update_conversation_title(conn, conversation_id, title)
+                    if updated:
+                        current_title = title
+                        print("Title updated.")
+                    else:
+                        print("Unable to update title.")
+                    continue
+                if command == "/memory":
+                    handle_memory_command(conn, args)
+                    continue
+                if command == "/history":
+                    limit = 10
+                    if args:
+                        try:
+                            limit = int(args[0])
+                        except ValueError:
+                            print("Usage: /history [number]")
+                            continue
+                    print_recent_history(conn, conversation_id, limit=limit)
+                    continue
+                if command == "/image":
+                    if not args:
+                        print("Usage: /image <path> [prompt]")
+                        continue
+                    image_path = args[0]
+                    prompt = " ".join(args[1:]).strip() or "Please analyze this image."
+                    try:
+                        user_message = create_user_message(text=prompt, image_paths=[image_path])
+                        send_user_message(conn, conversation_id, user_message, prompt)
+                    except Exception as exc:
+                        print(f"Error: {exc}")
+                    continue
+                if command == "/file":
+                    if not args:
+                        print("Usage: /file <path> [prompt]")
+                        continue
+                    file_path = args[0]
+                    ext = os.path.splitext(file_path)[1].lower()
+                    if ext not in TEXT_FILE_EXTENSIONS:
+                        print("Only text-like files are supported via /file (.txt, .md, .csv, .json, .py, .log).")
+                        continue
+                    prompt = " ".join(args[1:]).strip() or "Please read and summarize this file."
+                    try:
+                        user_message = create_user_message(text=prompt, text_file_paths=[file_path])
+                        send_user_message(conn, conversation_id, user_message, prompt)
+                    except Exception as exc:
+                        print(f"Error: {exc}")
                     continue
-                prompt = " ".join(args[1:]).strip() or "Please read and summarize this file."
-                try:
-                    user_message = create_user_message(text=prompt, text_file_paths=[file_path])
-                    send_user_message(conn, conversation_id, user_message, prompt)
-                except Exception as exc:
-                    print(f"Error: {exc}")
-                continue
-
-            print("Unknown command. Type /help for help.")
-            continue
 
-        user_message = create_user_message(text=user_input)
-        try:
-            send_user_message(conn, conversation_id, user_message, user_input)
-        except RuntimeError as exc:
-            print(f"Error: {exc}")
-            continue
+                print("Unknown command. Type /help for help.")
+                continue
 
-    conn.close()
+            user_message = create_user_message(text=user_input)
+            try:
+                send_user_message(conn, conversation_id, user_message, user_input)
+            except RuntimeError as exc:
+                print(f"Error: {exc}")
+                continue
+    finally:
+        close_db(conn)
     return 0
 
 
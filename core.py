@@ -1,24 +1,65 @@
+import hashlib
+import heapq
+import http.client
 import json
 import math
 import os
 import sqlite3
+import ssl
+import sys
+import threading
+import time
 import uuid
+import atexit
 import base64
 import mimetypes
+import operator
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from concurrent.futures import Future
 from dataclasses import dataclass
-from datetime import datetime
-from typing import Iterable, List, Optional, Tuple
-from urllib import error, request
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple, TypeVar, Union
+from urllib.parse import urlsplit
+
+try:
+    import orjson
+except ImportError:  # optional speedup; the stdlib json module is the fallback
+    orjson = None
+
+T = TypeVar("T")
+
+# Optional vector libraries, imported on first use by load_vector_libraries().
+np = None
+simsimd = None
+HNSWIndex = None
 
 DB_PATH = os.environ.get("CHATBOT_DB", "chatbot.db")
 API_URL = os.environ.get("OPENAI_API_URL", "https://api.openai.com/v1/responses")
+EMBEDDINGS_URL = os.environ.get("OPENAI_EMBEDDINGS_URL", "https://api.openai.com/v1/embeddings")
 MODEL = os.environ.get("OPENAI_MODEL", "gpt-4o-2024-11-20")
 MAX_HISTORY = int(os.environ.get("CHATBOT_MAX_HISTORY", "50"))
+MAX_HISTORY_TOKENS = int(os.environ.get("CHATBOT_MAX_HISTORY_TOKENS", "120000"))
 MAX_OUTPUT_TOKENS = int(os.environ.get("CHATBOT_MAX_OUTPUT_TOKENS", "800"))
 EMBEDDING_MODEL = os.environ.get("CHATBOT_EMBEDDING_MODEL", "text-embedding-3-small")
 EMBEDDINGS_ENABLED = os.environ.get("CHATBOT_USE_EMBEDDINGS", "1").lower() not in {"0", "false", "no"}
 EMBEDDINGS_TOP_K = int(os.environ.get("CHATBOT_EMBEDDINGS_TOP_K", "6"))
+PROMPT_MEMORY_LIMIT = int(os.environ.get("CHATBOT_PROMPT_MEMORY_LIMIT", "20"))
 ENV_PATH = os.environ.get("CHATBOT_ENV_FILE", ".env")
+CACHE_ENABLED = os.environ.get("CHATBOT_DISABLE_CACHE", "0").lower() in {"", "0", "false", "no"}
+CACHE_MAX_ENTRIES = int(os.environ.get("CHATBOT_CACHE_MAX_ENTRIES", "10000"))
+RESPONSE_MEMO_SIZE = 512
+MEMORIES_PROMPT_CACHE_SIZE = 128
+EMBEDDING_BATCH_SIZE = 256
+FSYNC_MODE = os.environ.get("CHATBOT_FSYNC", "normal").lower()
+SEMANTIC_CACHE_ENABLED = os.environ.get("CHATBOT_SEMANTIC_CACHE", "0").lower() not in {"0", "false", "no"}
+SEMANTIC_CACHE_THRESHOLD = float(os.environ.get("CHATBOT_SEMANTIC_CACHE_THRESHOLD", "0.92"))
+SEMANTIC_CACHE_TTL = int(os.environ.get("CHATBOT_SEMANTIC_CACHE_TTL", "3600"))
+HNSW_MIN_MEMORIES = int(os.environ.get("CHATBOT_HNSW_MIN_MEMORIES", "5000"))
+HNSW_INDEX_PATH = os.environ.get("CHATBOT_HNSW_INDEX", DB_PATH + ".usearch")
+HNSW_CHECKSUMS_PATH = HNSW_INDEX_PATH + ".checksums.npy"
 
 SCHEMA = """
 CREATE TABLE IF NOT EXISTS conversations (
@@ -27,6 +68,8 @@ CREATE TABLE IF NOT EXISTS conversations (
     created_at TEXT NOT NULL
 );
 
+CREATE INDEX IF NOT EXISTS idx_conversations_created ON conversations(created_at DESC);
+
 CREATE TABLE IF NOT EXISTS messages (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     conversation_id TEXT NOT NULL,
@@ -36,6 +79,8 @@ CREATE TABLE IF NOT EXISTS messages (
     FOREIGN KEY(conversation_id) REFERENCES conversations(id)
 );
 
+CREATE INDEX IF NOT EXISTS idx_messages_conv_id ON messages(conversation_id, id);
+
 CREATE TABLE IF NOT EXISTS memories (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     content TEXT NOT NULL,
@@ -44,176 +89,490 @@ CREATE TABLE IF NOT EXISTS memories (
 
 CREATE TABLE IF NOT EXISTS memory_embeddings (
     memory_id INTEGER PRIMARY KEY,
-    embedding TEXT NOT NULL,
+    embedding BLOB NOT NULL,
     updated_at TEXT NOT NULL,
     FOREIGN KEY(memory_id) REFERENCES memories(id) ON DELETE CASCADE
 );
+
+CREATE TABLE IF NOT EXISTS semantic_cache (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    conversation_id TEXT NOT NULL,
+    prompt TEXT NOT NULL,
+    embedding BLOB NOT NULL,
+    response TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    FOREIGN KEY(conversation_id) REFERENCES conversations(id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_semantic_cache_conversation
+    ON semantic_cache(conversation_id, created_at);
+
+CREATE INDEX IF NOT EXISTS idx_semantic_cache_created
+    ON semantic_cache(created_at);
 """
 
-SYSTEM_PROMPT_TEMPLATE = """You are ChatGPT 4o running via API.
+RESPONSE_CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS response_cache (
+    prompt_hash TEXT PRIMARY KEY,
+    response TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    last_used TEXT NOT NULL,
+    bytes INTEGER NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_response_cache_last_used ON response_cache(last_used);
+"""
 
-Use the following long-term memories to personalize responses. If they are irrelevant, ignore them.
-Memories:
+# The preamble has no interpolated fields so it stays a byte-identical prefix
+# for OpenAI's prompt caching; the volatile memories go in a later message.
+SYSTEM_PREAMBLE = """You are ChatGPT 4o running via API.
+
+The system message just before each user message lists long-term memories. Use them to personalize responses. If they are irrelevant, ignore them.
+"""
+
+MEMORIES_TEMPLATE = """Memories:
 {memories}
 """
 
 
+_SQL_INSERT_CONVERSATION = "INSERT INTO conversations (id, title, created_at) VALUES (?, ?, ?)"
+_SQL_LIST_CONVERSATIONS = (
+    "SELECT id, title, created_at FROM conversations ORDER BY created_at DESC LIMIT ?"
+)
+_SQL_LIST_CONVERSATIONS_BEFORE = """
+SELECT id, title, created_at
+FROM conversations
+WHERE created_at < ?
+ORDER BY created_at DESC
+LIMIT ?
+"""
+# JSON1 builds the web API's list payloads inside SQLite, so rows never
+# become Python objects.
+_SQL_LIST_CONVERSATIONS_JSON = """
+SELECT json_object('conversations', json_group_array(
+    json_object('id', id, 'title', title, 'created_at', created_at)
+))
+FROM (SELECT id, title, created_at FROM conversations ORDER BY created_at DESC)
+"""
+_SQL_CONVERSATION_JSON = """
+SELECT json_object(
+    'messages', json((
+        SELECT json_group_array(json_object('id', id, 'role', role, 'content', content))
+        FROM (
+            SELECT id, role, content FROM messages
+            WHERE conversation_id = ?1 AND id > ?2
+            ORDER BY id
+        )
+    )),
+    'title', (SELECT title FROM conversations WHERE id = ?1)
+)
+"""
+_SQL_LIST_MEMORIES_JSON = """
+SELECT json_object('memories', json_group_array(
+    json_object('id', id, 'content', content, 'created_at', created_at)
+))
+FROM (SELECT id, content, created_at FROM memories ORDER BY id)
+"""
+_SQL_CONVERSATION_EXISTS = "SELECT 1 FROM conversations WHERE id = ? LIMIT 1"
+_SQL_UPDATE_CONVERSATION_TITLE = "UPDATE conversations SET title = ? WHERE id = ?"
+_SQL_SELECT_CONVERSATION_TITLE = "SELECT title FROM conversations WHERE id = ?"
+_SQL_LIST_MEMORIES = "SELECT id, content, created_at FROM memories ORDER BY id"
+_SQL_LIST_RECENT_MEMORIES = """
+SELECT id, content, created_at
+FROM (SELECT id, content, created_at FROM memories ORDER BY id DESC LIMIT ?)
+ORDER BY id
+"""
+_SQL_INSERT_MEMORY = "INSERT INTO memories (content, created_at) VALUES (?, ?)"
+_SQL_DELETE_MEMORY = "DELETE FROM memories WHERE id = ?"
+_SQL_DELETE_MEMORY_EMBEDDING = "DELETE FROM memory_embeddings WHERE memory_id = ?"
+_SQL_MEMORY_FINGERPRINT = "SELECT IFNULL(MAX(id), 0), COUNT(*) FROM memories"
+_SQL_CLEAR_MEMORIES = "DELETE FROM memories"
+_SQL_CLEAR_MEMORY_EMBEDDINGS = "DELETE FROM memory_embeddings"
+_SQL_UPSERT_MEMORY_EMBEDDING = """
+INSERT INTO memory_embeddings (memory_id, embedding, updated_at)
+VALUES (?, ?, ?)
+ON CONFLICT(memory_id) DO UPDATE SET
+    embedding = excluded.embedding,
+    updated_at = excluded.updated_at
+"""
+_SQL_SELECT_MEMORY_EMBEDDINGS = """
+SELECT m.id, m.content, m.created_at, me.embedding
+FROM memories m
+LEFT JOIN memory_embeddings me ON m.id = me.memory_id
+ORDER BY m.id
+"""
+_SQL_INSERT_MESSAGE = (
+    "INSERT INTO messages (conversation_id, role, content, created_at) VALUES (?, ?, ?, ?)"
+)
+_SQL_SELECT_RECENT_MESSAGES = """
+SELECT role, content
+FROM (
+    SELECT id, role, content
+    FROM messages
+    WHERE conversation_id = ?
+    ORDER BY id DESC
+    LIMIT ?
+)
+ORDER BY id
+"""
+_SQL_SELECT_ALL_MESSAGES = "SELECT role, content FROM messages WHERE conversation_id = ? ORDER BY id"
+_SQL_SELECT_MESSAGES_SINCE = """
+SELECT id, role, content FROM messages WHERE conversation_id = ? AND id > ? ORDER BY id
+"""
+_SQL_SELECT_CACHED_RESPONSE = "SELECT response FROM response_cache WHERE prompt_hash = ?"
+_SQL_TOUCH_CACHED_RESPONSE = "UPDATE response_cache SET last_used = ? WHERE prompt_hash = ?"
+_SQL_UPSERT_CACHED_RESPONSE = """
+INSERT INTO response_cache (prompt_hash, response, created_at, last_used, bytes)
+VALUES (?, ?, ?, ?, ?)
+ON CONFLICT(prompt_hash) DO UPDATE SET
+    response = excluded.response,
+    last_used = excluded.last_used,
+    bytes = excluded.bytes
+"""
+_SQL_COUNT_CACHED_RESPONSES = "SELECT COUNT(*) FROM response_cache"
+_SQL_EVICT_CACHED_RESPONSES = """
+DELETE FROM response_cache WHERE prompt_hash IN (
+    SELECT prompt_hash FROM response_cache ORDER BY last_used ASC LIMIT ?
+)
+"""
+_SQL_SELECT_SEMANTIC_CACHE = """
+SELECT embedding, response
+FROM semantic_cache
+WHERE conversation_id = ? AND created_at >= ?
+"""
+_SQL_EXPIRE_SEMANTIC_CACHE = "DELETE FROM semantic_cache WHERE created_at < ?"
+_SQL_INSERT_SEMANTIC_CACHE = """
+INSERT INTO semantic_cache (conversation_id, prompt, embedding, response, created_at)
+VALUES (?, ?, ?, ?, ?)
+"""
+
+_RESPONSE_MEMO: "OrderedDict[str, str]" = OrderedDict()
+_RESPONSE_MEMO_LOCK = threading.Lock()
+_IN_FLIGHT: Dict[Tuple[str, ...], Future] = {}
+_IN_FLIGHT_LOCK = threading.Lock()
+_MEMORIES_PROMPT_CACHE: "OrderedDict[Tuple[int, int, Optional[str]], str]" = OrderedDict()
+_MEMORIES_PROMPT_LOCK = threading.Lock()
+_MEMORY_INDEX: Dict[str, object] = {"key": None, "memories": [], "vectors": None, "hnsw": None, "dirty": True}
+_MEMORY_INDEX_LOCK = threading.Lock()
+_MEMORY_HNSW = None
+_MEMORY_HNSW_CHECKSUMS: Dict[int, int] = {}
+_MEMORY_HNSW_LOCK = threading.Lock()
+_API_POOL: Dict[Tuple[str, str], List[http.client.HTTPConnection]] = {}
+_API_POOL_LOCK = threading.Lock()
+_API_SSL_CONTEXT: Optional[ssl.SSLContext] = None
+_API_WARMUPS: Dict[Tuple[str, str], List["Future[None]"]] = {}
+
+
+def dumps_json(obj: object) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode("utf-8")
+
+
+def loads_json(data: Union[bytes, str]) -> object:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
 @dataclass
 class Message:
     role: str
     content: object
 
 
+def utc_now() -> datetime:
+    # Stored timestamps are naive UTC ISO strings; keep that format so new rows
+    # still sort correctly against existing ones.
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
 def now_iso() -> str:
-    return datetime.utcnow().isoformat()
+    # Same text as utc_now().isoformat(), formatted in C without building a datetime.
+    now = time.time()
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(now)) + f".{int(now % 1 * 1_000_000):06d}"
 
 
-def connect_db() -> sqlite3.Connection:
-    conn = sqlite3.connect(DB_PATH)
+def connect_db(check_same_thread: bool = True) -> sqlite3.Connection:
+    conn = sqlite3.connect(DB_PATH, cached_statements=256, check_same_thread=check_same_thread)
     conn.row_factory = sqlite3.Row
+    synchronous = "FULL" if FSYNC_MODE == "full" else "NORMAL"
+    conn.executescript(
+        f"""
+        PRAGMA journal_mode=WAL;
+        PRAGMA synchronous={synchronous};
+        PRAGMA temp_store=MEMORY;
+        PRAGMA cache_size=-64000;
+        PRAGMA mmap_size=268435456;
+        """
+    )
     return conn
 
 
 def init_db(conn: sqlite3.Connection) -> None:
     conn.executescript(SCHEMA)
+    ensure_response_cache_schema(conn)
+    migrate_embeddings_to_blob(conn)
     conn.commit()
 
 
-def create_conversation(conn: sqlite3.Connection, title: Optional[str] = None) -> str:
+def close_db(conn: sqlite3.Connection) -> None:
+    # Refresh planner statistics and fold the WAL back into the main file so
+    # long-lived installs keep good plans and a bounded -wal file.
+    try:
+        conn.execute("PRAGMA optimize")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    finally:
+        conn.close()
+
+
+def ensure_response_cache_schema(conn: sqlite3.Connection) -> None:
+    conn.executescript(RESPONSE_CACHE_SCHEMA)
+
+
+def migrate_embeddings_to_blob(conn: sqlite3.Connection) -> None:
+    # Databases created before embeddings were stored as float32 BLOBs hold
+    # JSON text; convert those rows once so readers only see bytes.
+    for table, key in (("memory_embeddings", "memory_id"), ("semantic_cache", "id")):
+        rows = conn.execute(
+            f"SELECT {key}, embedding FROM {table} WHERE typeof(embedding) = 'text'"
+        ).fetchall()
+        if rows:
+            conn.executemany(
+                f"UPDATE {table} SET embedding = ? WHERE {key} = ?",
+                [(pack_embedding(loads_json(row["embedding"])), row[key]) for row in rows],
+            )
+
+
+def create_conversation(
+    conn: sqlite3.Connection, title: Optional[str] = None
+) -> Tuple[str, Optional[str]]:
     conversation_id = str(uuid.uuid4())
-    conn.execute(
-        "INSERT INTO conversations (id, title, created_at) VALUES (?, ?, ?)",
-        (conversation_id, title, now_iso()),
-    )
-    conn.commit()
-    return conversation_id
+    conn.execute(_SQL_INSERT_CONVERSATION, (conversation_id, title, now_iso()))
+    return conversation_id, title
 
 
-def list_conversations(conn: sqlite3.Connection) -> List[Tuple[str, Optional[str], str]]:
-    rows = conn.execute(
-        "SELECT id, title, created_at FROM conversations ORDER BY created_at DESC"
-    ).fetchall()
+def list_conversations(
+    conn: sqlite3.Connection, limit: Optional[int] = 25, before: Optional[str] = None
+) -> List[Tuple[str, Optional[str], str]]:
+    # A negative LIMIT means "no limit" in SQLite.
+    sql_limit = -1 if limit is None else limit
+    if before is None:
+        rows = conn.execute(_SQL_LIST_CONVERSATIONS, (sql_limit,)).fetchall()
+    else:
+        rows = conn.execute(_SQL_LIST_CONVERSATIONS_BEFORE, (before, sql_limit)).fetchall()
     return [(row["id"], row["title"], row["created_at"]) for row in rows]
 
 
+def list_conversations_json(conn: sqlite3.Connection) -> bytes:
+    try:
+        return conn.execute(_SQL_LIST_CONVERSATIONS_JSON).fetchone()[0].encode("utf-8")
+    except sqlite3.OperationalError:  # SQLite built without JSON1
+        conversations = [
+            {"id": convo_id, "title": title, "created_at": created_at}
+            for convo_id, title, created_at in list_conversations(conn, limit=None)
+        ]
+        return dumps_json({"conversations": conversations})
+
+
+def get_conversation_json(conn: sqlite3.Connection, conversation_id: str, since_id: int = 0) -> bytes:
+    # Only messages after since_id, so a client that has the transcript can
+    # fetch just what it is missing.
+    params = (conversation_id, since_id)
+    try:
+        return conn.execute(_SQL_CONVERSATION_JSON, params).fetchone()[0].encode("utf-8")
+    except sqlite3.OperationalError:
+        messages = [
+            {"id": message_id, "role": role, "content": content}
+            for message_id, role, content in get_messages_since(conn, conversation_id, since_id)
+        ]
+        return dumps_json({"messages": messages, "title": get_conversation_title(conn, conversation_id)})
+
+
 def conversation_exists(conn: sqlite3.Connection, conversation_id: str) -> bool:
-    row = conn.execute(
-        "SELECT 1 FROM conversations WHERE id = ? LIMIT 1", (conversation_id,)
-    ).fetchone()
+    row = conn.execute(_SQL_CONVERSATION_EXISTS, (conversation_id,)).fetchone()
     return row is not None
 
 
 def update_conversation_title(
     conn: sqlite3.Connection, conversation_id: str, title: str
 ) -> bool:
-    cur = conn.execute(
-        "UPDATE conversations SET title = ? WHERE id = ?",
-        (title, conversation_id),
-    )
-    conn.commit()
+    cur = conn.execute(_SQL_UPDATE_CONVERSATION_TITLE, (title, conversation_id))
     return cur.rowcount > 0
 
 
 def get_conversation_title(
     conn: sqlite3.Connection, conversation_id: str
 ) -> Optional[str]:
-    row = conn.execute(
-        "SELECT title FROM conversations WHERE id = ?",
-        (conversation_id,),
-    ).fetchone()
+    row = conn.execute(_SQL_SELECT_CONVERSATION_TITLE, (conversation_id,)).fetchone()
     return row["title"] if row else None
 
 
 def list_memories(conn: sqlite3.Connection) -> List[Tuple[int, str, str]]:
-    rows = conn.execute(
-        "SELECT id, content, created_at FROM memories ORDER BY id"
-    ).fetchall()
+    rows = conn.execute(_SQL_LIST_MEMORIES).fetchall()
+    return [(row["id"], row["content"], row["created_at"]) for row in rows]
+
+
+def list_memories_json(conn: sqlite3.Connection) -> bytes:
+    try:
+        return conn.execute(_SQL_LIST_MEMORIES_JSON).fetchone()[0].encode("utf-8")
+    except sqlite3.OperationalError:
+        memories = [
+            {"id": mem_id, "content": content, "created_at": created_at}
+            for mem_id, content, created_at in list_memories(conn)
+        ]
+        return dumps_json({"memories": memories})
+
+
+def list_memories_for_prompt(
+    conn: sqlite3.Connection, limit: int = PROMPT_MEMORY_LIMIT
+) -> List[Tuple[int, str, str]]:
+    rows = conn.execute(_SQL_LIST_RECENT_MEMORIES, (limit,)).fetchall()
     return [(row["id"], row["content"], row["created_at"]) for row in rows]
 
 
 def call_openai_embeddings(input_text: str) -> List[float]:
+    if not CACHE_ENABLED:
+        return request_embedding(input_text, EMBEDDING_MODEL)
+    return list(_embed_cached(input_text, EMBEDDING_MODEL))
+
+
+@lru_cache(maxsize=512)
+def _embed_cached(input_text: str, model: str) -> Tuple[float, ...]:
+    embedding, _ = single_flight(
+        ("embedding", model, input_text), lambda: request_embedding(input_text, model)
+    )
+    return tuple(embedding)
+
+
+def call_openai_embeddings_batch(input_texts: List[str]) -> List[List[float]]:
+    # The embeddings endpoint takes a list input, so N texts cost one round
+    # trip per EMBEDDING_BATCH_SIZE instead of one each.
+    embeddings: List[List[float]] = []
+    for start in range(0, len(input_texts), EMBEDDING_BATCH_SIZE):
+        embeddings.extend(request_embeddings(input_texts[start : start + EMBEDDING_BATCH_SIZE], EMBEDDING_MODEL))
+    return embeddings
+
+
+def request_embedding(input_text: str, model: str) -> List[float]:
+    return request_embeddings(input_text, model)[0]
+
+
+def request_embeddings(input_text: Union[str, List[str]], model: str) -> List[List[float]]:
     api_key = os.environ.get("OPENAI_API_KEY")
     if not api_key:
         raise RuntimeError("OPENAI_API_KEY environment variable is not set.")
 
     payload = {
-        "model": EMBEDDING_MODEL,
+        "model": model,
         "input": input_text,
     }
 
-    data = json.dumps(payload).encode("utf-8")
-    req = request.Request(
-        "https://api.openai.com/v1/embeddings",
-        data=data,
-        method="POST",
-        headers={
+    # Shares the keep-alive pool with the Responses API calls, so embedding a
+    # memory or query reuses an open TLS connection instead of handshaking.
+    connection, response = open_api_request(
+        EMBEDDINGS_URL,
+        dumps_json(payload),
+        {
             "Authorization": f"Bearer {api_key}",
             "Content-Type": "application/json",
         },
     )
-
     try:
-        with request.urlopen(req, timeout=90) as response:
-            response_data = json.loads(response.read().decode("utf-8"))
-    except error.HTTPError as http_error:
-        detail = http_error.read().decode("utf-8")
-        raise RuntimeError(
-            f"OpenAI Embeddings API error ({http_error.code}): {detail}"
-        ) from http_error
+        body = response.read()
+    except BaseException:
+        connection.close()
+        raise
+    release_api_connection(EMBEDDINGS_URL, connection)
+    if response.status >= 400:
+        raise RuntimeError(f"OpenAI Embeddings API error ({response.status}): {body.decode('utf-8')}")
+    response_data = loads_json(body)
 
     try:
-        return response_data["data"][0]["embedding"]
+        items = sorted(response_data["data"], key=lambda item: item["index"])
+        return [item["embedding"] for item in items]
     except (KeyError, IndexError, TypeError) as exc:
         raise RuntimeError(f"Unexpected Embeddings API response format: {response_data}") from exc
 
 
 def upsert_memory_embedding(conn: sqlite3.Connection, memory_id: int, embedding: List[float]) -> None:
-    conn.execute(
-        """
-        INSERT INTO memory_embeddings (memory_id, embedding, updated_at)
-        VALUES (?, ?, ?)
-        ON CONFLICT(memory_id) DO UPDATE SET
-            embedding = excluded.embedding,
-            updated_at = excluded.updated_at
-        """,
-        (memory_id, json.dumps(embedding), now_iso()),
-    )
-    conn.commit()
+    conn.execute(_SQL_UPSERT_MEMORY_EMBEDDING, (memory_id, pack_embedding(embedding), now_iso()))
+    invalidate_memory_index()
 
 
-def add_memory(conn: sqlite3.Connection, content: str) -> None:
-    cur = conn.execute(
-        "INSERT INTO memories (content, created_at) VALUES (?, ?)",
-        (content, now_iso()),
-    )
+def pack_embedding(embedding: List[float]) -> bytes:
+    # Raw little-endian float32: ~4x smaller than JSON and loadable without
+    # parsing. Stored unit-length, so ranking is a plain dot product.
+    packed = array("f", normalize_embedding(embedding))
+    if sys.byteorder == "big":
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def unpack_embedding(blob: bytes) -> List[float]:
+    unpacked = array("f")
+    unpacked.frombytes(blob)
+    if sys.byteorder == "big":
+        unpacked.byteswap()
+    return unpacked.tolist()
+
+
+def add_memory(conn: sqlite3.Connection, content: str) -> Tuple[int, str, str]:
+    # Embed before writing so the caller's transaction isn't held open
+    # across the HTTPS round trip.
+    embedding = call_openai_embeddings(content) if EMBEDDINGS_ENABLED else None
+    created_at = now_iso()
+    cur = conn.execute(_SQL_INSERT_MEMORY, (content, created_at))
     memory_id = cur.lastrowid
-    conn.commit()
 
-    if EMBEDDINGS_ENABLED and memory_id is not None:
-        embedding = call_openai_embeddings(content)
+    if embedding is not None and memory_id is not None:
         upsert_memory_embedding(conn, memory_id, embedding)
+    invalidate_memory_index()
+    return memory_id, content, created_at
+
+
+def add_memories_bulk(conn: sqlite3.Connection, contents: Iterable[str]) -> None:
+    # Embeddings for these rows are backfilled by find_relevant_memories.
+    created_at = now_iso()
+    with conn:
+        conn.executemany(_SQL_INSERT_MEMORY, [(content, created_at) for content in contents])
+    # Refresh planner statistics after a bulk load; a no-op when they are current.
+    conn.execute("PRAGMA optimize")
+    invalidate_memory_index()
 
 
 def delete_memory(conn: sqlite3.Connection, memory_id: int) -> bool:
-    cur = conn.execute("DELETE FROM memories WHERE id = ?", (memory_id,))
-    conn.execute("DELETE FROM memory_embeddings WHERE memory_id = ?", (memory_id,))
-    conn.commit()
+    cur = conn.execute(_SQL_DELETE_MEMORY, (memory_id,))
+    conn.execute(_SQL_DELETE_MEMORY_EMBEDDING, (memory_id,))
+    invalidate_memory_index()
     return cur.rowcount > 0
 
 
 def clear_memories(conn: sqlite3.Connection) -> None:
-    conn.execute("DELETE FROM memories")
-    conn.execute("DELETE FROM memory_embeddings")
-    conn.commit()
+    conn.execute(_SQL_CLEAR_MEMORIES)
+    conn.execute(_SQL_CLEAR_MEMORY_EMBEDDINGS)
+    invalidate_memory_index()
 
 
 def add_message(conn: sqlite3.Connection, conversation_id: str, message: Message) -> None:
     content = message.content if isinstance(message.content, str) else summarize_content(message.content)
-    conn.execute(
-        "INSERT INTO messages (conversation_id, role, content, created_at) VALUES (?, ?, ?, ?)",
-        (conversation_id, message.role, content, now_iso()),
-    )
-    conn.commit()
+    conn.execute(_SQL_INSERT_MESSAGE, (conversation_id, message.role, content, now_iso()))
+
+
+def add_messages_bulk(
+    conn: sqlite3.Connection, conversation_id: str, messages: List[Message]
+) -> List[int]:
+    created_at = now_iso()
+    rows = [
+        (conversation_id, message.role, summarize_content(message.content), created_at)
+        for message in messages
+    ]
+    with conn:
+        conn.executemany(_SQL_INSERT_MESSAGE, rows)
+        # The batch holds the write lock, so its AUTOINCREMENT ids are
+        # consecutive and end at last_insert_rowid().
+        last_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+    return list(range(last_id - len(rows) + 1, last_id + 1))
 
 
 def summarize_content(content: object) -> str:
@@ -280,115 +639,418 @@ def create_user_message(
 
 
 def get_recent_messages(conn: sqlite3.Connection, conversation_id: str) -> List[Message]:
-    rows = conn.execute(
-        """
-        SELECT role, content
-        FROM messages
-        WHERE conversation_id = ?
-        ORDER BY id DESC
-        LIMIT ?
-        """,
-        (conversation_id, MAX_HISTORY),
-    ).fetchall()
-    return [Message(row["role"], row["content"]) for row in reversed(rows)]
+    rows = conn.execute(_SQL_SELECT_RECENT_MESSAGES, (conversation_id, MAX_HISTORY)).fetchall()
+
+    # Keep the longest suffix of the conversation that fits the token budget.
+    start = len(rows)
+    budget = MAX_HISTORY_TOKENS
+    while start > 0:
+        budget -= count_tokens(rows[start - 1]["content"])
+        if budget < 0:
+            break
+        start -= 1
+    return [Message(row["role"], row["content"]) for row in rows[start:]]
+
+
+def count_tokens(text: str) -> int:
+    encoding = token_encoding()
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+@lru_cache(maxsize=1)
+def token_encoding() -> Optional[object]:
+    try:
+        import tiktoken
+
+        return tiktoken.get_encoding("o200k_base")
+    except Exception:  # not installed, or its encoding file cannot be fetched
+        return None
 
 
 def get_all_messages(conn: sqlite3.Connection, conversation_id: str) -> List[Message]:
-    rows = conn.execute(
-        """
-        SELECT role, content
-        FROM messages
-        WHERE conversation_id = ?
-        ORDER BY id
-        """,
-        (conversation_id,),
-    ).fetchall()
+    rows = conn.execute(_SQL_SELECT_ALL_MESSAGES, (conversation_id,)).fetchall()
     return [Message(row["role"], row["content"]) for row in rows]
 
 
-def cosine_similarity(a: List[float], b: List[float]) -> float:
-    dot = sum(x * y for x, y in zip(a, b))
-    mag_a = math.sqrt(sum(x * x for x in a))
-    mag_b = math.sqrt(sum(y * y for y in b))
-    if mag_a == 0 or mag_b == 0:
-        return -1.0
-    return dot / (mag_a * mag_b)
+def get_messages_since(
+    conn: sqlite3.Connection, conversation_id: str, since_id: int
+) -> List[Tuple[int, str, str]]:
+    rows = conn.execute(_SQL_SELECT_MESSAGES_SINCE, (conversation_id, since_id)).fetchall()
+    return [(row["id"], row["role"], row["content"]) for row in rows]
 
 
-def find_relevant_memories(conn: sqlite3.Connection, query: str, top_k: int = EMBEDDINGS_TOP_K) -> List[Tuple[int, str, str]]:
-    if not EMBEDDINGS_ENABLED:
-        return list_memories(conn)
+def normalize_embedding(embedding: List[float]) -> List[float]:
+    norm = math.sqrt(sum(x * x for x in embedding))
+    if norm == 0:
+        return list(embedding)
+    return [x / norm for x in embedding]
 
-    query_embedding = call_openai_embeddings(query)
-    rows = conn.execute(
-        """
-        SELECT m.id, m.content, m.created_at, me.embedding
-        FROM memories m
-        LEFT JOIN memory_embeddings me ON m.id = me.memory_id
-        ORDER BY m.id
-        """
-    ).fetchall()
 
-    scored = []
-    for row in rows:
-        emb_raw = row["embedding"]
-        if emb_raw is None:
-            memory_embedding = call_openai_embeddings(row["content"])
-            upsert_memory_embedding(conn, row["id"], memory_embedding)
-        else:
-            memory_embedding = json.loads(emb_raw)
+def dot_product(a: List[float], b: List[float]) -> float:
+    # Cosine similarity for the unit-length vectors pack_embedding stores.
+    return sum(map(operator.mul, a, b))
+
 
-        score = cosine_similarity(query_embedding, memory_embedding)
-        scored.append((score, row["id"], row["content"], row["created_at"]))
+def find_relevant_memories(conn: sqlite3.Connection, query: str, top_k: int = EMBEDDINGS_TOP_K) -> List[Tuple[int, str, str]]:
+    if not EMBEDDINGS_ENABLED:
+        return list_memories(conn)
 
-    scored.sort(key=lambda item: item[0], reverse=True)
-    best = scored[: max(1, top_k)]
-    return [(mem_id, content, created_at) for _, mem_id, content, created_at in best]
+    query_embedding = normalize_embedding(call_openai_embeddings(query))
+    memories, vectors, hnsw = load_memory_index(conn)
+    if not memories:
+        return []
+    k = min(max(1, top_k), len(memories))
+    if hnsw is not None:
+        return search_memory_hnsw(hnsw, memories, query_embedding, k)
+    if np is not None:
+        top = top_k_cosine_numpy(query_embedding, vectors, k)
+    else:
+        scores = [dot_product(query_embedding, vector) for vector in vectors]
+        top = heapq.nlargest(k, range(len(scores)), key=scores.__getitem__)
+    return [memories[index] for index in top]
+
+
+def invalidate_memory_index() -> None:
+    with _MEMORY_INDEX_LOCK:
+        _MEMORY_INDEX["dirty"] = True
+    # Re-embedding can change rankings without changing the fingerprint.
+    with _MEMORIES_PROMPT_LOCK:
+        _MEMORIES_PROMPT_CACHE.clear()
+
+
+def load_memory_index(conn: sqlite3.Connection):
+    # Memories change rarely but are ranked on every turn, so keep the decoded
+    # vectors in memory. The fingerprint also catches writes from other
+    # processes sharing the database (e.g. the CLI and the web app).
+    load_vector_libraries()
+    row = conn.execute(_SQL_MEMORY_FINGERPRINT).fetchone()
+    key = (row[0], row[1])
+    with _MEMORY_INDEX_LOCK:
+        if not _MEMORY_INDEX["dirty"] and _MEMORY_INDEX["key"] == key:
+            return _MEMORY_INDEX["memories"], _MEMORY_INDEX["vectors"], _MEMORY_INDEX["hnsw"]
+
+    rows = conn.execute(_SQL_SELECT_MEMORY_EMBEDDINGS).fetchall()
+
+    memories = [(row["id"], row["content"], row["created_at"]) for row in rows]
+    blobs: List[Optional[bytes]] = [row["embedding"] for row in rows]
+    missing = [index for index, blob in enumerate(blobs) if blob is None]
+    if missing:
+        backfilled = call_openai_embeddings_batch([memories[index][1] for index in missing])
+        updated_at = now_iso()
+        for index, memory_embedding in zip(missing, backfilled):
+            blobs[index] = pack_embedding(memory_embedding)
+        with conn:
+            conn.executemany(
+                _SQL_UPSERT_MEMORY_EMBEDDING,
+                [(memories[index][0], blobs[index], updated_at) for index in missing],
+            )
+
+    hnsw = None
+    if np is not None and blobs:
+        # One allocation for the whole matrix instead of a parse per row.
+        vectors = np.frombuffer(b"".join(blobs), dtype="<f4").reshape(len(blobs), -1)
+        if HNSWIndex is not None and len(memories) >= HNSW_MIN_MEMORIES:
+            memory_ids = np.array([memory[0] for memory in memories], dtype=np.uint64)
+            checksums = [embedding_checksum(blob) for blob in blobs]
+            hnsw = sync_memory_hnsw(memory_ids, vectors, checksums)
+        if simsimd is not None:
+            vectors = quantize_embeddings(vectors)
+    else:
+        vectors = [unpack_embedding(blob) for blob in blobs]
+
+    with _MEMORY_INDEX_LOCK:
+        _MEMORY_INDEX.update(key=key, memories=memories, vectors=vectors, hnsw=hnsw, dirty=False)
+    return memories, vectors, hnsw
+
+
+def embedding_checksum(blob: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(blob, digest_size=8).digest(), "little")
+
+
+def sync_memory_hnsw(memory_ids, matrix, checksums: List[int]):
+    # Keys are memory ids, so after the first build (or a restore from disk)
+    # only added, re-embedded and deleted memories touch the graph. An id alone
+    # doesn't pin a vector (the database may have been replaced since the index
+    # was saved), so each key is checked against the embedding it was built from.
+    global _MEMORY_HNSW, _MEMORY_HNSW_CHECKSUMS
+    with _MEMORY_HNSW_LOCK:
+        index, indexed = _MEMORY_HNSW, _MEMORY_HNSW_CHECKSUMS
+        if index is None and os.path.exists(HNSW_INDEX_PATH):
+            try:
+                index = HNSWIndex.restore(HNSW_INDEX_PATH)
+                indexed = dict(np.load(HNSW_CHECKSUMS_PATH).tolist())
+            except Exception:
+                index = None
+        if index is None or index.ndim != matrix.shape[1]:
+            index = HNSWIndex(
+                ndim=matrix.shape[1], metric="cos", dtype="f16", connectivity=16, expansion_add=64
+            )
+            indexed = {}
+        current = dict(zip(memory_ids.tolist(), checksums))
+        keys = np.asarray(index.keys, dtype=np.uint64).tolist()
+        stale = [key for key in keys if indexed.get(key) != current.get(key)]
+        if stale:
+            index.remove(np.array(stale, dtype=np.uint64))
+        missing = ~index.contains(memory_ids)
+        if missing.any():
+            index.add(memory_ids[missing], matrix[missing])
+        _MEMORY_HNSW, _MEMORY_HNSW_CHECKSUMS = index, current
+        return index
+
+
+def search_memory_hnsw(hnsw, memories: List[Tuple[int, str, str]], query_embedding: List[float], k: int):
+    with _MEMORY_HNSW_LOCK:
+        matches = hnsw.search(np.asarray(query_embedding, dtype=np.float32), k)
+    # memories is ordered by id, so each key is found by bisection.
+    found = []
+    for key in matches.keys:
+        position = bisect_left(memories, (int(key),))
+        if position < len(memories) and memories[position][0] == key:
+            found.append(memories[position])
+    return found
+
+
+def save_memory_hnsw() -> None:
+    with _MEMORY_HNSW_LOCK:
+        if _MEMORY_HNSW is not None:
+            _MEMORY_HNSW.save(HNSW_INDEX_PATH)
+            checksums = np.array(list(_MEMORY_HNSW_CHECKSUMS.items()), dtype=np.uint64).reshape(-1, 2)
+            np.save(HNSW_CHECKSUMS_PATH, checksums)
+
+
+def top_k_cosine_numpy(query_embedding: List[float], matrix, k: int) -> List[int]:
+    query = np.asarray(query_embedding, dtype=np.float32)
+    scores = cosine_scores_numpy(query, matrix)
+    # argpartition finds the top k in O(N); only those k are sorted.
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])].tolist()
+
+
+def quantize_embeddings(vectors):
+    # Cosine is scale-invariant, so a symmetric per-vector int8 quantization
+    # needs no stored scale; SimSIMD has dedicated int8 kernels.
+    scale = np.abs(vectors).max(axis=-1, keepdims=True)
+    scale[scale == 0] = 1.0
+    return np.round(vectors / scale * 127).astype(np.int8)
+
+
+def cosine_scores_numpy(query, matrix):
+    if simsimd is not None:
+        if matrix.dtype == np.int8:
+            query = quantize_embeddings(query)
+        # SimSIMD's SIMD cosine kernel normalizes on the fly.
+        distances = np.asarray(simsimd.cdist(query[None, :], matrix, metric="cosine"))
+        return 1.0 - distances[0]
+    # Stored rows and the query are unit-length: one GEMV scores every memory.
+    return matrix @ query
+
+
+@lru_cache(maxsize=1)
+def load_vector_libraries() -> None:
+    # Only memory ranking needs these, so keep them off the startup path (and
+    # out of runs with embeddings off).
+    global np, simsimd, HNSWIndex
+    try:
+        import numpy as np
+    except ImportError:  # memories are scored in pure Python
+        return
+    try:
+        import simsimd
+    except ImportError:
+        simsimd = None
+    try:
+        from usearch.index import Index as HNSWIndex
+    except ImportError:  # large memory stores fall back to brute force
+        HNSWIndex = None
+
+
+def build_prompt_messages(
+    conn: sqlite3.Connection,
+    history: List[Message],
+    user_message: Message,
+    query: Optional[str] = None,
+) -> List[Message]:
+    # History comes before the memories so that the preamble plus the whole
+    # transcript remain a stable, cacheable prefix when memories change.
+    return [
+        Message("system", SYSTEM_PREAMBLE),
+        *history,
+        Message("system", build_memories_prompt(conn, query)),
+        user_message,
+    ]
 
 
-def build_system_prompt(conn: sqlite3.Connection, query: Optional[str] = None) -> str:
-    if query and EMBEDDINGS_ENABLED:
-        memories = find_relevant_memories(conn, query)
+def build_memories_prompt(conn: sqlite3.Connection, query: Optional[str] = None) -> str:
+    # AUTOINCREMENT ids are never reused, so (MAX(id), COUNT(*)) changes on
+    # every add, delete or clear and is enough to invalidate the rendering.
+    # Ranked prompts also key on the query, so a repeated message skips the
+    # embedding lookup and the ranking.
+    ranked = bool(query and EMBEDDINGS_ENABLED)
+    row = conn.execute(_SQL_MEMORY_FINGERPRINT).fetchone()
+    key = (row[0], row[1], query if ranked else None)
+    with _MEMORIES_PROMPT_LOCK:
+        memories_prompt = _MEMORIES_PROMPT_CACHE.get(key)
+        if memories_prompt is not None:
+            _MEMORIES_PROMPT_CACHE.move_to_end(key)
+            return memories_prompt
+
+    if ranked:
+        memories_prompt = render_memories_prompt(find_relevant_memories(conn, query))
     else:
-        memories = list_memories(conn)
+        memories_prompt = render_memories_prompt(list_memories_for_prompt(conn))
+    with _MEMORIES_PROMPT_LOCK:
+        _MEMORIES_PROMPT_CACHE[key] = memories_prompt
+        while len(_MEMORIES_PROMPT_CACHE) > MEMORIES_PROMPT_CACHE_SIZE:
+            _MEMORIES_PROMPT_CACHE.popitem(last=False)
+    return memories_prompt
+
 
+def render_memories_prompt(memories: List[Tuple[int, str, str]]) -> str:
     if memories:
         memory_lines = [f"- ({mem_id}) {content}" for mem_id, content, _ in memories]
         memories_text = "\n".join(memory_lines)
     else:
         memories_text = "- (none)"
 
-    return SYSTEM_PROMPT_TEMPLATE.format(memories=memories_text)
+    return MEMORIES_TEMPLATE.format(memories=memories_text)
 
 
-def call_openai(messages: Iterable[Message]) -> str:
-    api_key = os.environ.get("OPENAI_API_KEY")
-    if not api_key:
-        raise RuntimeError("OPENAI_API_KEY environment variable is not set.")
-
+def call_openai(
+    messages: Iterable[Message],
+    conn: Optional[sqlite3.Connection] = None,
+    on_delta: Optional[Callable[[str], None]] = None,
+) -> str:
     payload = {
         "model": MODEL,
         "input": [{"role": message.role, "content": message.content} for message in messages],
         "max_output_tokens": MAX_OUTPUT_TOKENS,
     }
+    data = dumps_json(payload)
+    if not CACHE_ENABLED:
+        return send_response_request(payload, data, on_delta)
+
+    prompt_hash = hashlib.sha256(data).hexdigest()
+    cached = recall_response(prompt_hash)
+    if cached is None and conn is not None:
+        cached = get_cached_response(conn, prompt_hash)
+    if cached is not None:
+        remember_response(prompt_hash, cached)
+        if on_delta is not None:
+            on_delta(cached)
+        return cached
+
+    def fetch() -> str:
+        text = send_response_request(payload, data, on_delta)
+        remember_response(prompt_hash, text)
+        return text
+
+    response_text, coalesced = single_flight(("response", prompt_hash), fetch)
+    if coalesced:
+        # An identical request was already in flight; reuse its reply, which
+        # that request has memoized and stores.
+        if on_delta is not None:
+            on_delta(response_text)
+        return response_text
+    if conn is not None:
+        store_cached_response(conn, prompt_hash, response_text)
+    return response_text
+
+
+def single_flight(key: Tuple[str, ...], compute: Callable[[], T]) -> Tuple[T, bool]:
+    # Concurrent callers with the same key share one upstream request; the
+    # flag tells followers they received the leader's result.
+    with _IN_FLIGHT_LOCK:
+        future = _IN_FLIGHT.get(key)
+        leader = future is None
+        if leader:
+            future = _IN_FLIGHT[key] = Future()
+    if not leader:
+        try:
+            return future.result(), True
+        except Exception:
+            # The leader failed (or its client went away); try on our own.
+            return compute(), False
+
+    try:
+        result = compute()
+    except BaseException as exc:
+        future.set_exception(exc)
+        raise
+    finally:
+        with _IN_FLIGHT_LOCK:
+            _IN_FLIGHT.pop(key, None)
+    future.set_result(result)
+    return result, False
+
+
+def send_response_request(
+    payload: dict, data: bytes, on_delta: Optional[Callable[[str], None]]
+) -> str:
+    if on_delta is None:
+        return request_response(data)
+    stream_data = dumps_json({**payload, "stream": True})
+    return stream_response(stream_data, on_delta)
+
+
+def recall_response(prompt_hash: str) -> Optional[str]:
+    with _RESPONSE_MEMO_LOCK:
+        response_text = _RESPONSE_MEMO.get(prompt_hash)
+        if response_text is not None:
+            _RESPONSE_MEMO.move_to_end(prompt_hash)
+        return response_text
+
+
+def remember_response(prompt_hash: str, response_text: str) -> None:
+    with _RESPONSE_MEMO_LOCK:
+        _RESPONSE_MEMO[prompt_hash] = response_text
+        _RESPONSE_MEMO.move_to_end(prompt_hash)
+        while len(_RESPONSE_MEMO) > RESPONSE_MEMO_SIZE:
+            _RESPONSE_MEMO.popitem(last=False)
+
+
+def get_cached_response(conn: sqlite3.Connection, prompt_hash: str) -> Optional[str]:
+    row = conn.execute(_SQL_SELECT_CACHED_RESPONSE, (prompt_hash,)).fetchone()
+    if row is None:
+        return None
+    conn.execute(_SQL_TOUCH_CACHED_RESPONSE, (now_iso(), prompt_hash))
+    return row["response"]
+
+
+def store_cached_response(conn: sqlite3.Connection, prompt_hash: str, response_text: str) -> None:
+    timestamp = now_iso()
+    conn.execute(
+        _SQL_UPSERT_CACHED_RESPONSE,
+        (prompt_hash, response_text, timestamp, timestamp, len(response_text.encode("utf-8"))),
+    )
+    count = conn.execute(_SQL_COUNT_CACHED_RESPONSES).fetchone()[0]
+    if count > CACHE_MAX_ENTRIES:
+        conn.execute(_SQL_EVICT_CACHED_RESPONSES, (count - CACHE_MAX_ENTRIES,))
 
-    data = json.dumps(payload).encode("utf-8")
-    req = request.Request(
+
+def request_response(data: bytes) -> str:
+    api_key = os.environ.get("OPENAI_API_KEY")
+    if not api_key:
+        raise RuntimeError("OPENAI_API_KEY environment variable is not set.")
+
+    connection, response = open_api_request(
         API_URL,
-        data=data,
-        method="POST",
-        headers={
+        data,
+        {
             "Authorization": f"Bearer {api_key}",
             "Content-Type": "application/json",
         },
     )
-
     try:
-        with request.urlopen(req, timeout=90) as response:
-            response_data = json.loads(response.read().decode("utf-8"))
-    except error.HTTPError as http_error:
-        detail = http_error.read().decode("utf-8")
-        raise RuntimeError(f"OpenAI API error ({http_error.code}): {detail}") from http_error
+        body = response.read()
+    except BaseException:
+        connection.close()
+        raise
+    release_api_connection(API_URL, connection)
+    if response.status >= 400:
+        raise RuntimeError(f"OpenAI API error ({response.status}): {body.decode('utf-8')}")
+    response_data = loads_json(body)
 
     try:
         return response_data["output"][0]["content"][0]["text"]
@@ -396,6 +1058,233 @@ def call_openai(messages: Iterable[Message]) -> str:
         raise RuntimeError(f"Unexpected API response format: {response_data}") from exc
 
 
+def stream_response(data: bytes, on_delta: Callable[[str], None]) -> str:
+    api_key = os.environ.get("OPENAI_API_KEY")
+    if not api_key:
+        raise RuntimeError("OPENAI_API_KEY environment variable is not set.")
+
+    connection, response = open_api_request(
+        API_URL,
+        data,
+        {
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json",
+            "Accept": "text/event-stream",
+        },
+    )
+
+    parts: List[str] = []
+    try:
+        if response.status >= 400:
+            detail = response.read().decode("utf-8")
+            raise RuntimeError(f"OpenAI API error ({response.status}): {detail}")
+        for event in iter_sse_events(response):
+            event_type = event.get("type")
+            if event_type == "response.output_text.delta":
+                delta = event.get("delta") or ""
+                parts.append(delta)
+                on_delta(delta)
+            elif event_type in {"error", "response.failed"}:
+                raise RuntimeError(f"OpenAI API stream error: {event}")
+    except BaseException:
+        # A half-read stream leaves the socket unusable for the next request.
+        connection.close()
+        raise
+    release_api_connection(API_URL, connection)
+
+    return "".join(parts)
+
+
+def open_api_request(
+    url: str, data: bytes, headers: Dict[str, str]
+) -> Tuple[http.client.HTTPConnection, http.client.HTTPResponse]:
+    parsed = urlsplit(url)
+    path = f"{parsed.path}?{parsed.query}" if parsed.query else parsed.path
+    connection = acquire_api_connection(url)
+    try:
+        try:
+            connection.request("POST", path, body=data, headers=headers)
+            response = connection.getresponse()
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            # The server may drop an idle keep-alive socket; retry once on a new one.
+            connection.close()
+            connection.request("POST", path, body=data, headers=headers)
+            response = connection.getresponse()
+    except BaseException:
+        connection.close()
+        raise
+    return connection, response
+
+
+def acquire_api_connection(url: str) -> http.client.HTTPConnection:
+    parsed = urlsplit(url)
+    key = (parsed.scheme, parsed.netloc)
+    with _API_POOL_LOCK:
+        idle = _API_POOL.get(key)
+        if idle:
+            return idle.pop()
+        warmups = _API_WARMUPS.get(key)
+        warmup = warmups.pop() if warmups else None
+    if warmup is not None:
+        # Only requests that really go to the network wait for a prefetch.
+        warmup.result()
+        with _API_POOL_LOCK:
+            idle = _API_POOL.get(key)
+            if idle:
+                return idle.pop()
+    return new_api_connection(url)
+
+
+def new_api_connection(url: str) -> http.client.HTTPConnection:
+    parsed = urlsplit(url)
+    if parsed.scheme == "https":
+        return http.client.HTTPSConnection(parsed.netloc, timeout=90, context=api_ssl_context())
+    return http.client.HTTPConnection(parsed.netloc, timeout=90)
+
+
+def api_ssl_context() -> ssl.SSLContext:
+    global _API_SSL_CONTEXT
+    if _API_SSL_CONTEXT is None:
+        _API_SSL_CONTEXT = ssl.create_default_context()
+    return _API_SSL_CONTEXT
+
+
+def close_api_connections() -> None:
+    with _API_POOL_LOCK:
+        idle = [connection for connections in _API_POOL.values() for connection in connections]
+        _API_POOL.clear()
+    for connection in idle:
+        connection.close()
+
+
+def release_api_connection(url: str, connection: http.client.HTTPConnection) -> None:
+    parsed = urlsplit(url)
+    with _API_POOL_LOCK:
+        _API_POOL.setdefault((parsed.scheme, parsed.netloc), []).append(connection)
+
+
+def warm_api_connection(url: str = API_URL, future: Optional["Future[None]"] = None) -> None:
+    try:
+        connection = new_api_connection(url)
+        try:
+            connection.connect()
+        except OSError:
+            # Best effort: the real request reconnects and reports the error.
+            connection.close()
+        else:
+            release_api_connection(url, connection)
+    finally:
+        if future is not None:
+            parsed = urlsplit(url)
+            with _API_POOL_LOCK:
+                warmups = _API_WARMUPS.get((parsed.scheme, parsed.netloc), [])
+                if future in warmups:
+                    warmups.remove(future)
+            future.set_result(None)
+
+
+def prefetch_api_connection(url: str = API_URL) -> None:
+    # Connect in the background while the prompt is built. Callers don't wait:
+    # cache hits never need the socket, and acquire_api_connection waits on
+    # the pending connect only for a request that goes out.
+    parsed = urlsplit(url)
+    key = (parsed.scheme, parsed.netloc)
+    future: "Future[None]" = Future()
+    with _API_POOL_LOCK:
+        if _API_POOL.get(key) or _API_WARMUPS.get(key):
+            return
+        _API_WARMUPS.setdefault(key, []).append(future)
+    threading.Thread(target=warm_api_connection, args=(url, future), daemon=True).start()
+
+
+atexit.register(close_api_connections)
+atexit.register(save_memory_hnsw)
+
+
+def iter_sse_events(lines: Iterable[bytes]) -> Iterator[dict]:
+    for raw_line in lines:
+        line = raw_line.decode("utf-8").strip()
+        if not line.startswith("data:"):
+            continue
+        event_data = line[len("data:") :].strip()
+        if not event_data or event_data == "[DONE]":
+            continue
+        yield loads_json(event_data)
+
+
+def plain_text_query(message: Message) -> Optional[str]:
+    # Only plain text turns are safe to answer from the semantic cache; an
+    # image or file attached to the same prompt must always reach the model.
+    if isinstance(message.content, str):
+        return message.content.strip() or None
+    if isinstance(message.content, list) and len(message.content) == 1:
+        block = message.content[0]
+        if isinstance(block, dict) and block.get("type") == "input_text":
+            return str(block.get("text", "")).strip() or None
+    return None
+
+
+def semantic_cache_cutoff(now: Optional[datetime] = None) -> str:
+    return ((now or utc_now()) - timedelta(seconds=SEMANTIC_CACHE_TTL)).isoformat()
+
+
+def find_semantic_cache_hit(
+    conn: sqlite3.Connection, conversation_id: str, query_embedding: List[float]
+) -> Optional[str]:
+    rows = conn.execute(
+        _SQL_SELECT_SEMANTIC_CACHE, (conversation_id, semantic_cache_cutoff())
+    ).fetchall()
+
+    query_embedding = normalize_embedding(query_embedding)
+    best_score = SEMANTIC_CACHE_THRESHOLD
+    best_response = None
+    for row in rows:
+        score = dot_product(query_embedding, unpack_embedding(row["embedding"]))
+        if score > best_score:
+            best_score = score
+            best_response = row["response"]
+    return best_response
+
+
+def store_semantic_cache_entry(
+    conn: sqlite3.Connection,
+    conversation_id: str,
+    prompt: str,
+    embedding: List[float],
+    response: str,
+) -> None:
+    now = utc_now()
+    # Expire across all conversations; rows for ones that never get another
+    # turn would otherwise outlive the TTL.
+    conn.execute(_SQL_EXPIRE_SEMANTIC_CACHE, (semantic_cache_cutoff(now),))
+    conn.execute(
+        _SQL_INSERT_SEMANTIC_CACHE,
+        (conversation_id, prompt, pack_embedding(embedding), response, now.isoformat()),
+    )
+
+
+def generate_response(
+    conn: sqlite3.Connection,
+    conversation_id: str,
+    messages: List[Message],
+    on_delta: Optional[Callable[[str], None]] = None,
+) -> str:
+    query = plain_text_query(messages[-1]) if SEMANTIC_CACHE_ENABLED and messages else None
+    if query is None:
+        return call_openai(messages, conn, on_delta)
+
+    query_embedding = call_openai_embeddings(query)
+    cached = find_semantic_cache_hit(conn, conversation_id, query_embedding)
+    if cached is not None:
+        if on_delta is not None:
+            on_delta(cached)
+        return cached
+
+    response_text = call_openai(messages, conn, on_delta)
+    store_semantic_cache_entry(conn, conversation_id, query, query_embedding, response_text)
+    return response_text
+
+
 def load_env_file(path: str) -> None:
     if not os.path.exists(path):
         return
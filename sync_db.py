@@ -3,23 +3,43 @@ import argparse
 import os
 import sqlite3
 import sys
-from datetime import datetime
+from datetime import datetime, timezone
+from typing import Callable, Optional
 
 DB_PATH = os.environ.get("CHATBOT_DB", "chatbot.db")
+BACKUP_PAGES_PER_STEP = 1024
+BACKUP_SLEEP_SECONDS = 0.001
 
 
 def timestamp() -> str:
-    return datetime.utcnow().strftime("%Y%m%d-%H%M%S")
+    return datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S")
 
 
-def backup_db(source: str, dest: str) -> None:
+def backup_db(
+    source: str, dest: str, progress: Optional[Callable[[int, int, int], object]] = None
+) -> None:
     if not os.path.exists(source):
         raise FileNotFoundError(f"Source database not found: {source}")
 
     os.makedirs(os.path.dirname(dest) or ".", exist_ok=True)
 
     with sqlite3.connect(source) as src, sqlite3.connect(dest) as dst:
-        src.backup(dst)
+        # In WAL mode the app keeps reading and writing while pages are copied;
+        # copying in steps releases the source lock between them.
+        src.execute("PRAGMA journal_mode=WAL")
+        src.backup(
+            dst,
+            pages=BACKUP_PAGES_PER_STEP,
+            progress=progress,
+            sleep=BACKUP_SLEEP_SECONDS,
+        )
+
+
+def print_progress(status: int, remaining: int, total: int) -> None:
+    copied = total - remaining
+    print(f"\rCopied {copied}/{total} pages", end="", file=sys.stderr, flush=True)
+    if remaining == 0:
+        print(file=sys.stderr)
 
 
 def main() -> int:
@@ -44,7 +64,7 @@ def main() -> int:
         dest = f"{base}-backup-{timestamp()}{ext}"
 
     try:
-        backup_db(args.source, dest)
+        backup_db(args.source, dest, progress=print_progress if sys.stderr.isatty() else None)
     except Exception as exc:  # pragma: no cover - CLI error path
         print(f"Error: {exc}")
         return 1
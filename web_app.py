@@ -1,33 +1,69 @@
-import json
+import atexit
+import base64
+import gzip
+import hashlib
 import os
+import queue
+import re
+import sqlite3
+import threading
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
 from http import HTTPStatus
-from http.server import BaseHTTPRequestHandler, HTTPServer
-from urllib.parse import urlparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import parse_qs, unquote, urlparse
 
 from core import (
     ENV_PATH,
     Message,
     add_memory,
-    add_message,
-    build_system_prompt,
+    add_messages_bulk,
+    build_prompt_messages,
     build_user_content,
-    call_openai,
     clear_memories,
+    close_db,
     connect_db,
     create_conversation,
     delete_memory,
-    get_all_messages,
-    get_conversation_title,
+    dumps_json,
+    generate_response,
+    get_conversation_json,
     get_recent_messages,
     init_db,
-    list_conversations,
-    list_memories,
+    list_conversations_json,
+    list_memories_json,
     load_env_file,
+    loads_json,
+    prefetch_api_connection,
+    summarize_content,
     update_conversation_title,
 )
 
 HOST = os.environ.get("CHATBOT_WEB_HOST", "0.0.0.0")
 PORT = int(os.environ.get("CHATBOT_WEB_PORT", "8000"))
+PAYLOAD_CACHE_SIZE = int(os.environ.get("CHATBOT_WEB_CACHE_SIZE", "64"))
+EVENT_KEEPALIVE_SECONDS = 15
+MAX_UPLOAD_BYTES = 20 * 1024 * 1024
+MAX_PENDING_UPLOADS = 32
+
+_ID_ROUTE_RE = re.compile(r"^/api/(conversations|memories)/([^/]+)$")
+
+_DB_POOL: List[sqlite3.Connection] = []
+_DB_POOL_LOCK = threading.Lock()
+_DATA_VERSIONS: Dict[sqlite3.Connection, int] = {}
+
+_PAYLOAD_CACHE: "OrderedDict[str, Tuple[str, bytes]]" = OrderedDict()
+_PAYLOAD_CACHE_LOCK = threading.Lock()
+_PAYLOAD_CACHE_GENERATION = 0
+
+# Raw image uploads waiting for the /api/send that references them.
+_UPLOADS: "OrderedDict[str, Tuple[str, bytes]]" = OrderedDict()
+_UPLOADS_LOCK = threading.Lock()
+
+_EVENT_SUBSCRIBERS: List["queue.SimpleQueue[bytes]"] = []
+_EVENT_SUBSCRIBERS_LOCK = threading.Lock()
 
 INDEX_HTML = """<!doctype html>
 <html lang="en">
@@ -217,6 +253,10 @@ INDEX_HTML = """<!doctype html>
         conversations: [],
         activeConversation: null,
         memories: [],
+        // Conversation id -> messages (with ids) already fetched, in order.
+        transcripts: new Map(),
+        // Conversation id -> the turn still streaming, under pending keys.
+        pending: new Map(),
       };
 
       const conversationList = document.getElementById("conversationList");
@@ -231,9 +271,12 @@ INDEX_HTML = """<!doctype html>
       const memoryList = document.getElementById("memoryList");
       const clearMemoriesBtn = document.getElementById("clearMemories");
 
+      // Tags this page's writes so it can skip their echo on /api/events.
+      const clientId = Math.random().toString(36).slice(2);
+
       const api = async (path, options = {}) => {
         const response = await fetch(path, {
-          headers: { "Content-Type": "application/json" },
+          headers: { "Content-Type": "application/json", "X-Client-Id": clientId },
           ...options,
         });
         if (!response.ok) {
@@ -243,31 +286,109 @@ INDEX_HTML = """<!doctype html>
         return response.json();
       };
 
-      const renderConversations = () => {
-        conversationList.innerHTML = "";
-        state.conversations.forEach((convo) => {
-          const button = document.createElement("button");
-          button.textContent = `${convo.title || "Untitled"} · ${convo.id.slice(0, 8)}`;
-          button.className = convo.id === state.activeConversation ? "active" : "";
-          button.onclick = () => selectConversation(convo.id);
-          conversationList.appendChild(button);
+      // Keyed DOM reconciliation: reuse the node for each key, create only
+      // new ones, move nodes only when out of place, and drop stale keys.
+      const syncList = (container, nodes, items, keyOf, create, update) => {
+        const keep = new Set();
+        items.forEach((item, index) => {
+          const key = keyOf(item);
+          keep.add(key);
+          let node = nodes.get(key);
+          if (!node) {
+            node = create(item);
+            nodes.set(key, node);
+          }
+          if (update) update(node, item);
+          if (container.children[index] !== node) {
+            container.insertBefore(node, container.children[index] || null);
+          }
         });
+        nodes.forEach((node, key) => {
+          if (!keep.has(key)) {
+            node.remove();
+            nodes.delete(key);
+          }
+        });
+      };
+
+      const conversationNodes = new Map();
+      const memoryNodes = new Map();
+      const messageNodes = new Map();
+
+      const renderConversations = () => {
+        syncList(
+          conversationList,
+          conversationNodes,
+          state.conversations,
+          (convo) => convo.id,
+          (convo) => {
+            const button = document.createElement("button");
+            button.onclick = () => selectConversation(convo.id);
+            return button;
+          },
+          (button, convo) => {
+            const label = `${convo.title || "Untitled"} · ${convo.id.slice(0, 8)}`;
+            if (button.textContent !== label) button.textContent = label;
+            const className = convo.id === state.activeConversation ? "active" : "";
+            if (button.className !== className) button.className = className;
+          }
+        );
       };
 
+      // Messages are keyed by id (or a pending key before they are stored),
+      // so a render never reuses another message's bubble.
       const renderMessages = (messages = []) => {
-        messageList.innerHTML = "";
-        messages.forEach((message) => {
-          const bubble = document.createElement("div");
-          bubble.className = `bubble ${message.role}`;
-          bubble.textContent = message.content;
-          messageList.appendChild(bubble);
-        });
+        syncList(
+          messageList,
+          messageNodes,
+          messages,
+          (message) => message.id ?? message.key,
+          () => document.createElement("div"),
+          (bubble, message) => {
+            const className = `bubble ${message.role}`;
+            if (bubble.className !== className) bubble.className = className;
+            if (bubble.textContent !== message.content) bubble.textContent = message.content;
+          }
+        );
         messageList.scrollTop = messageList.scrollHeight;
       };
 
+      const showMessages = (conversationId) => {
+        if (conversationId !== state.activeConversation) return;
+        const transcript = state.transcripts.get(conversationId) || [];
+        renderMessages([...transcript, ...(state.pending.get(conversationId) || [])]);
+      };
+
+      const streamApi = async (path, body, onEvent) => {
+        const response = await fetch(path, {
+          method: "POST",
+          headers: { "Content-Type": "application/json", "X-Client-Id": clientId },
+          body: JSON.stringify(body),
+        });
+        if (!response.ok) {
+          const text = await response.text();
+          throw new Error(text || "Request failed");
+        }
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = "";
+        while (true) {
+          const { value, done } = await reader.read();
+          if (done) break;
+          buffer += decoder.decode(value, { stream: true });
+          let boundary;
+          while ((boundary = buffer.indexOf("\\n\\n")) !== -1) {
+            const frame = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+            if (frame.startsWith("data: ")) {
+              onEvent(JSON.parse(frame.slice(6)));
+            }
+          }
+        }
+      };
+
       const renderMemories = () => {
-        memoryList.innerHTML = "";
-        state.memories.forEach((memory) => {
+        syncList(memoryList, memoryNodes, state.memories, (memory) => memory.id, (memory) => {
           const card = document.createElement("div");
           card.className = "memory-item";
           const text = document.createElement("div");
@@ -284,10 +405,71 @@ INDEX_HTML = """<!doctype html>
           card.appendChild(text);
           card.appendChild(meta);
           card.appendChild(actions);
-          memoryList.appendChild(card);
+          return card;
         });
       };
 
+      const addConversation = (convo) => {
+        if (!state.conversations.some((c) => c.id === convo.id)) {
+          state.conversations.unshift(convo);
+        }
+        renderConversations();
+      };
+
+      const upsertMemory = (memory) => {
+        if (!state.memories.some((m) => m.id === memory.id)) {
+          state.memories.push(memory);
+        }
+        renderMemories();
+      };
+
+      const removeMemory = (id) => {
+        state.memories = state.memories.filter((m) => m.id !== id);
+        renderMemories();
+      };
+
+      const applyEvent = (event) => {
+        if (event.source === clientId) return;
+        if (event.type === "conversation") {
+          addConversation(event.conversation);
+        } else if (event.type === "title") {
+          const convo = state.conversations.find((c) => c.id === event.conversation_id);
+          if (convo) convo.title = event.title;
+          if (event.conversation_id === state.activeConversation) {
+            conversationTitle.textContent = event.title || "Chat";
+          }
+          renderConversations();
+        } else if (event.type === "messages") {
+          // A transcript not loaded yet gets these with its first full fetch.
+          if (!state.transcripts.has(event.conversation_id)) return;
+          mergeMessages(event.conversation_id, event.messages);
+          showMessages(event.conversation_id);
+        } else if (event.type === "memory") {
+          upsertMemory(event.memory);
+        } else if (event.type === "memory_deleted") {
+          removeMemory(event.id);
+        } else if (event.type === "memories_cleared") {
+          state.memories = [];
+          renderMemories();
+        }
+      };
+
+      const listenForEvents = () => {
+        const events = new EventSource("/api/events");
+        let dropped = false;
+        events.onmessage = (message) => applyEvent(JSON.parse(message.data));
+        events.onerror = () => {
+          dropped = true;
+        };
+        // Changes made while disconnected were missed; resync once.
+        events.onopen = () => {
+          if (!dropped) return;
+          dropped = false;
+          loadConversations();
+          loadMemories();
+        };
+      };
+
       const loadConversations = async () => {
         const data = await api("/api/conversations");
         state.conversations = data.conversations;
@@ -300,10 +482,29 @@ INDEX_HTML = """<!doctype html>
         }
       };
 
+      const lastMessageId = (messages) => (messages.length ? messages[messages.length - 1].id : 0);
+
+      const mergeMessages = (conversationId, messages) => {
+        const transcript = state.transcripts.get(conversationId) || [];
+        const lastId = lastMessageId(transcript);
+        messages.forEach((message) => {
+          if (message.id > lastId) transcript.push(message);
+        });
+        state.transcripts.set(conversationId, transcript);
+        return transcript;
+      };
+
       const loadMessages = async (conversationId) => {
-        const data = await api(`/api/conversations/${conversationId}`);
+        // Show what we already have, then fetch only the messages after it.
+        const cached = state.transcripts.get(conversationId);
+        if (cached) showMessages(conversationId);
+        const since = cached ? lastMessageId(cached) : 0;
+        const query = since ? `?since=${since}` : "";
+        const data = await api(`/api/conversations/${conversationId}${query}`);
+        mergeMessages(conversationId, data.messages);
+        if (conversationId !== state.activeConversation) return;
         conversationTitle.textContent = data.title || "Chat";
-        renderMessages(data.messages);
+        showMessages(conversationId);
       };
 
       const loadMemories = async () => {
@@ -321,7 +522,10 @@ INDEX_HTML = """<!doctype html>
       const createConversation = async () => {
         const data = await api("/api/conversations", { method: "POST" });
         state.activeConversation = data.id;
-        await loadConversations();
+        addConversation({ id: data.id, title: null });
+        state.transcripts.set(data.id, []);
+        conversationTitle.textContent = "Chat";
+        showMessages(data.id);
       };
 
       const sendMessage = async () => {
@@ -333,12 +537,16 @@ INDEX_HTML = """<!doctype html>
         const attachments = [];
         for (const file of files) {
           if (file.type.startsWith("image/")) {
-            const dataUrl = await new Promise((resolve) => {
-              const reader = new FileReader();
-              reader.onload = () => resolve(reader.result);
-              reader.readAsDataURL(file);
+            const upload = await api("/api/upload", {
+              method: "POST",
+              headers: {
+                "Content-Type": file.type,
+                "X-File-Name": encodeURIComponent(file.name),
+                "X-Client-Id": clientId,
+              },
+              body: file,
             });
-            attachments.push({ kind: "image", name: file.name, data_url: dataUrl });
+            attachments.push({ kind: "image", name: file.name, id: upload.id });
           } else {
             const text = await file.text();
             attachments.push({ kind: "text", name: file.name, text });
@@ -347,36 +555,66 @@ INDEX_HTML = """<!doctype html>
 
         messageInput.value = "";
         fileInput.value = "";
-        await api("/api/send", {
-          method: "POST",
-          body: JSON.stringify({
-            conversation_id: state.activeConversation,
-            content,
-            attachments,
-          }),
-        });
-        await loadMessages(state.activeConversation);
+        const conversationId = state.activeConversation;
+        // The turn is built here, not read back from the DOM: the user may
+        // switch conversations while it streams.
+        const userMessage = { key: "pending-user", role: "user", content };
+        const assistantMessage = { key: "pending-assistant", role: "assistant", content: "" };
+        state.pending.set(conversationId, [userMessage, assistantMessage]);
+        showMessages(conversationId);
+        try {
+          await streamApi(
+            "/api/send_stream",
+            { conversation_id: conversationId, content, attachments },
+            (event) => {
+              if (event.user !== undefined) {
+                userMessage.content = event.user;
+              }
+              if (event.delta) {
+                assistantMessage.content += event.delta;
+              }
+              if (event.error) {
+                assistantMessage.content = `Error: ${event.error}`;
+              }
+              if (event.done) {
+                state.pending.delete(conversationId);
+                if (state.transcripts.has(conversationId)) {
+                  const [userId, assistantId] = event.ids;
+                  mergeMessages(conversationId, [
+                    { id: userId, role: "user", content: userMessage.content },
+                    { id: assistantId, role: "assistant", content: assistantMessage.content },
+                  ]);
+                }
+              }
+              showMessages(conversationId);
+            }
+          );
+        } catch (error) {
+          assistantMessage.content = `Error: ${error.message}`;
+          showMessages(conversationId);
+        }
       };
 
       const addMemory = async () => {
         const content = memoryInput.value.trim();
         if (!content) return;
         memoryInput.value = "";
-        await api("/api/memories", {
+        const data = await api("/api/memories", {
           method: "POST",
           body: JSON.stringify({ content }),
         });
-        await loadMemories();
+        upsertMemory(data.memory);
       };
 
       const deleteMemory = async (id) => {
         await api(`/api/memories/${id}`, { method: "DELETE" });
-        await loadMemories();
+        removeMemory(id);
       };
 
       const clearMemories = async () => {
         await api("/api/memories", { method: "DELETE" });
-        await loadMemories();
+        state.memories = [];
+        renderMemories();
       };
 
       newConversationBtn.onclick = createConversation;
@@ -392,21 +630,193 @@ INDEX_HTML = """<!doctype html>
 
       loadConversations();
       loadMemories();
+      listenForEvents();
     </script>
   </body>
 </html>
 """
 
 
+def payload_etag(payload: bytes) -> str:
+    return f'"{hashlib.sha256(payload).hexdigest()[:16]}"'
+
+
+# The page is static, so encode, compress and fingerprint it once.
+_INDEX_BYTES = INDEX_HTML.encode("utf-8")
+_INDEX_GZIP = gzip.compress(_INDEX_BYTES, 9)
+_INDEX_ETAG = payload_etag(_INDEX_BYTES)
+# Each encoding is a different representation, so it needs its own strong tag.
+_INDEX_GZIP_ETAG = _INDEX_ETAG[:-1] + '-gzip"'
+
+# Constant acknowledgement bodies for the write endpoints.
+_OK_JSON = b'{"status":"ok"}'
+_UPDATED_JSON = {True: b'{"updated":true}', False: b'{"updated":false}'}
+_DELETED_JSON = {True: b'{"deleted":true}', False: b'{"deleted":false}'}
+
+
+@contextmanager
+def pooled_connection() -> Iterator[sqlite3.Connection]:
+    # Reuse open connections instead of connecting (and re-running the schema)
+    # per request; each request's work commits or rolls back as one unit.
+    with _DB_POOL_LOCK:
+        conn = _DB_POOL.pop() if _DB_POOL else None
+    if conn is None:
+        conn = connect_db(check_same_thread=False)
+    # data_version moves when another connection (a pool sibling or the CLI)
+    # commits, so cached payloads may be stale. A new connection has no
+    # baseline and can't tell what changed, so it invalidates too.
+    data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+    if _DATA_VERSIONS.get(conn) != data_version:
+        invalidate_payloads()
+    _DATA_VERSIONS[conn] = data_version
+    try:
+        with conn:
+            yield conn
+    finally:
+        with _DB_POOL_LOCK:
+            _DB_POOL.append(conn)
+
+
+def close_pooled_connections() -> None:
+    with _DB_POOL_LOCK:
+        idle = list(_DB_POOL)
+        _DB_POOL.clear()
+    for conn in idle:
+        _DATA_VERSIONS.pop(conn, None)
+        close_db(conn)
+
+
+atexit.register(close_pooled_connections)
+
+
+def cached_payload(key: str, load: Callable[[], bytes]) -> Tuple[str, bytes]:
+    # Payloads are kept serialized (with their ETag) so a hit is a lookup and
+    # a write.
+    with _PAYLOAD_CACHE_LOCK:
+        entry = _PAYLOAD_CACHE.get(key)
+        if entry is not None:
+            _PAYLOAD_CACHE.move_to_end(key)
+            return entry
+        generation = _PAYLOAD_CACHE_GENERATION
+    payload = load()
+    entry = (payload_etag(payload), payload)
+    with _PAYLOAD_CACHE_LOCK:
+        # Drop the result if something was invalidated while it was loading.
+        if generation == _PAYLOAD_CACHE_GENERATION:
+            _PAYLOAD_CACHE[key] = entry
+            while len(_PAYLOAD_CACHE) > PAYLOAD_CACHE_SIZE:
+                _PAYLOAD_CACHE.popitem(last=False)
+    return entry
+
+
+def invalidate_payloads(*keys: str) -> None:
+    # Call after the write has committed; no keys clears everything.
+    global _PAYLOAD_CACHE_GENERATION
+    with _PAYLOAD_CACHE_LOCK:
+        _PAYLOAD_CACHE_GENERATION += 1
+        if not keys:
+            _PAYLOAD_CACHE.clear()
+        for key in keys:
+            _PAYLOAD_CACHE.pop(key, None)
+
+
+def store_upload(mime_type: str, data: bytes) -> str:
+    upload_id = uuid.uuid4().hex
+    with _UPLOADS_LOCK:
+        _UPLOADS[upload_id] = (mime_type, data)
+        while len(_UPLOADS) > MAX_PENDING_UPLOADS:
+            _UPLOADS.popitem(last=False)
+    return upload_id
+
+
+def take_upload_data_url(upload_id: str) -> Optional[str]:
+    # Base64 happens here, once, when the OpenAI request is built.
+    with _UPLOADS_LOCK:
+        upload = _UPLOADS.pop(upload_id, None)
+    if upload is None:
+        return None
+    mime_type, data = upload
+    return f"data:{mime_type};base64,{base64.b64encode(data).decode('ascii')}"
+
+
+def publish_event(event: dict) -> None:
+    # Fan a change out to every open /api/events stream so pages apply the
+    # delta instead of refetching whole lists.
+    frame = b"data: " + dumps_json(event) + b"\n\n"
+    with _EVENT_SUBSCRIBERS_LOCK:
+        for subscriber in _EVENT_SUBSCRIBERS:
+            subscriber.put(frame)
+
+
+def reply_to_message(
+    conn: sqlite3.Connection,
+    conversation_id: str,
+    content: str,
+    user_message: Message,
+    on_delta: Optional[Callable[[str], None]] = None,
+) -> Tuple[str, List[int]]:
+    prefetch_api_connection()
+    history = get_recent_messages(conn, conversation_id)
+    messages = build_prompt_messages(conn, history, user_message, content or "Attachment upload")
+    response_text = generate_response(conn, conversation_id, messages, on_delta)
+    message_ids = add_messages_bulk(conn, conversation_id, [user_message, Message("assistant", response_text)])
+    return response_text, message_ids
+
+
 class ChatHandler(BaseHTTPRequestHandler):
+    # Keep connections open across the page's burst of API calls. Writes are
+    # buffered so headers and body leave in one send; idle sockets time out.
+    protocol_version = "HTTP/1.1"
+    wbufsize = -1
+    disable_nagle_algorithm = True
+    timeout = 60
+
+    def handle(self) -> None:
+        try:
+            super().handle()
+        except ConnectionError:
+            # The client went away mid-stream. The frame that failed to send is
+            # still buffered, and every later flush would retry it.
+            self.close_connection = True
+
+    def finish(self) -> None:
+        try:
+            super().finish()
+        except ConnectionError:
+            self.rfile.close()
+
     def _send_json(self, data: dict, status: HTTPStatus = HTTPStatus.OK) -> None:
-        payload = json.dumps(data).encode("utf-8")
+        self._send_json_bytes(dumps_json(data), status)
+
+    def _send_json_bytes(self, payload: bytes, status: HTTPStatus = HTTPStatus.OK) -> None:
         self.send_response(status)
         self.send_header("Content-Type", "application/json")
         self.send_header("Content-Length", str(len(payload)))
         self.end_headers()
         self.wfile.write(payload)
 
+    def _send_cached_json(self, etag: str, payload: bytes) -> None:
+        # The browser's HTTP cache revalidates these with If-None-Match, so an
+        # unchanged list costs a 304 instead of the whole body.
+        if self._send_not_modified(etag):
+            return
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _send_not_modified(self, etag: str) -> bool:
+        if_none_match = self.headers.get("If-None-Match", "")
+        if etag not in if_none_match and if_none_match.strip() != "*":
+            return False
+        self.send_response(HTTPStatus.NOT_MODIFIED)
+        self.send_header("ETag", etag)
+        self.end_headers()
+        return True
+
     def _send_text(self, text: str, status: HTTPStatus = HTTPStatus.OK) -> None:
         payload = text.encode("utf-8")
         self.send_response(status)
@@ -415,149 +825,301 @@ class ChatHandler(BaseHTTPRequestHandler):
         self.end_headers()
         self.wfile.write(payload)
 
+    def _send_index(self) -> None:
+        use_gzip = "gzip" in self.headers.get("Accept-Encoding", "").lower()
+        etag = _INDEX_GZIP_ETAG if use_gzip else _INDEX_ETAG
+        if self._send_not_modified(etag):
+            return
+
+        payload = _INDEX_GZIP if use_gzip else _INDEX_BYTES
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(payload)))
+        if use_gzip:
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Vary", "Accept-Encoding")
+        # Revalidate on every visit: unchanged pages cost a 304, new releases
+        # are picked up immediately.
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _start_event_stream(self) -> None:
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        # The stream has no Content-Length, so its end is the connection's.
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+    def _send_event(self, data: dict) -> None:
+        self.wfile.write(b"data: " + dumps_json(data) + b"\n\n")
+        self.wfile.flush()
+
+    def _read_send_request(self) -> Optional[Tuple[str, str, Message]]:
+        payload = self._read_json()
+        conversation_id = payload.get("conversation_id")
+        content = (payload.get("content") or "").strip()
+        attachments = payload.get("attachments") or []
+        if not conversation_id or (not content and not attachments):
+            self._send_text("Missing conversation_id and message payload", HTTPStatus.BAD_REQUEST)
+            return None
+
+        image_data_urls = []
+        for attachment in attachments:
+            if attachment.get("kind") != "image":
+                continue
+            if attachment.get("id"):
+                data_url = take_upload_data_url(attachment["id"])
+                if data_url is None:
+                    self._send_text("Unknown or expired upload id", HTTPStatus.BAD_REQUEST)
+                    return None
+                image_data_urls.append(data_url)
+            elif attachment.get("data_url"):
+                image_data_urls.append(attachment["data_url"])
+        file_texts = [(a.get("name") or "file", a.get("text") or "") for a in attachments if a.get("kind") == "text"]
+        user_content = build_user_content(content or None, image_data_urls, file_texts)
+        return conversation_id, content, Message("user", user_content)
+
+    def _publish(self, event: dict) -> None:
+        # Pages skip events tagged with their own id; they already applied them.
+        event["source"] = self.headers.get("X-Client-Id")
+        publish_event(event)
+
+    def _publish_turn(
+        self, send_request: Tuple[str, str, Message], response_text: str, message_ids: List[int]
+    ) -> None:
+        conversation_id, _, user_message = send_request
+        user_id, assistant_id = message_ids
+        messages = [
+            {"id": user_id, "role": "user", "content": summarize_content(user_message.content)},
+            {"id": assistant_id, "role": "assistant", "content": response_text},
+        ]
+        self._publish({"type": "messages", "conversation_id": conversation_id, "messages": messages})
+
+    def _read_body(self) -> bytes:
+        length, self._unread_body = self._unread_body, 0
+        return self.rfile.read(length) if length else b""
+
     def _read_json(self) -> dict:
-        length = int(self.headers.get("Content-Length", "0"))
-        if length == 0:
+        body = self._read_body()
+        if not body:
             return {}
-        raw = self.rfile.read(length).decode("utf-8")
-        return json.loads(raw)
+        return loads_json(body)
 
-    def do_GET(self) -> None:
-        parsed = urlparse(self.path)
-        if parsed.path == "/":
-            payload = INDEX_HTML.encode("utf-8")
-            self.send_response(HTTPStatus.OK)
-            self.send_header("Content-Type", "text/html; charset=utf-8")
-            self.send_header("Content-Length", str(len(payload)))
-            self.end_headers()
-            self.wfile.write(payload)
-            return
+    def _serve_index(self) -> None:
+        self._send_index()
 
-        if parsed.path == "/api/conversations":
-            with connect_db() as conn:
-                init_db(conn)
-                conversations = [
-                    {"id": convo_id, "title": title, "created_at": created_at}
-                    for convo_id, title, created_at in list_conversations(conn)
-                ]
-            self._send_json({"conversations": conversations})
-            return
+    def _list_conversations(self) -> None:
+        with pooled_connection() as conn:
+            entry = cached_payload("conversations", lambda: list_conversations_json(conn))
+        self._send_cached_json(*entry)
 
-        if parsed.path.startswith("/api/conversations/"):
-            conversation_id = parsed.path.split("/")[-1]
-            with connect_db() as conn:
-                init_db(conn)
-                messages = [
-                    {"role": message.role, "content": message.content}
-                    for message in get_all_messages(conn, conversation_id)
-                ]
-                title = get_conversation_title(conn, conversation_id)
-            self._send_json({"messages": messages, "title": title})
+    def _get_conversation(self, conversation_id: str) -> None:
+        since = parse_qs(urlparse(self.path).query).get("since", ["0"])[0]
+        try:
+            since_id = int(since)
+        except ValueError:
+            self._send_text("Invalid since id", HTTPStatus.BAD_REQUEST)
             return
-
-        if parsed.path == "/api/memories":
-            with connect_db() as conn:
-                init_db(conn)
-                memories = [
-                    {"id": mem_id, "content": content, "created_at": created_at}
-                    for mem_id, content, created_at in list_memories(conn)
-                ]
-            self._send_json({"memories": memories})
+        if since_id > 0:
+            # Deltas are small index range scans; only full transcripts are cached.
+            with pooled_connection() as conn:
+                payload = get_conversation_json(conn, conversation_id, since_id)
+            self._send_json_bytes(payload)
             return
+        with pooled_connection() as conn:
+            entry = cached_payload(
+                f"conversation:{conversation_id}",
+                lambda: get_conversation_json(conn, conversation_id),
+            )
+        self._send_cached_json(*entry)
 
-        self._send_text("Not found", status=HTTPStatus.NOT_FOUND)
+    def _list_memories(self) -> None:
+        with pooled_connection() as conn:
+            entry = cached_payload("memories", lambda: list_memories_json(conn))
+        self._send_cached_json(*entry)
 
-    def do_POST(self) -> None:
-        parsed = urlparse(self.path)
-        if parsed.path == "/api/conversations":
-            with connect_db() as conn:
-                init_db(conn)
-                conversation_id = create_conversation(conn)
-            self._send_json({"id": conversation_id})
-            return
+    def _stream_events(self) -> None:
+        self._start_event_stream()
+        subscriber: "queue.SimpleQueue[bytes]" = queue.SimpleQueue()
+        with _EVENT_SUBSCRIBERS_LOCK:
+            _EVENT_SUBSCRIBERS.append(subscriber)
+        try:
+            frame = b": connected\n\n"
+            while True:
+                self.wfile.write(frame)
+                self.wfile.flush()
+                try:
+                    frame = subscriber.get(timeout=EVENT_KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    # A comment line keeps proxies from timing the stream out
+                    # and surfaces clients that went away.
+                    frame = b": keepalive\n\n"
+        except OSError:
+            pass
+        finally:
+            with _EVENT_SUBSCRIBERS_LOCK:
+                _EVENT_SUBSCRIBERS.remove(subscriber)
 
-        if parsed.path == "/api/send":
-            payload = self._read_json()
-            conversation_id = payload.get("conversation_id")
-            content = (payload.get("content") or "").strip()
-            attachments = payload.get("attachments") or []
-            if not conversation_id or (not content and not attachments):
-                self._send_text("Missing conversation_id and message payload", HTTPStatus.BAD_REQUEST)
-                return
-
-            image_data_urls = [a.get("data_url") for a in attachments if a.get("kind") == "image" and a.get("data_url")]
-            file_texts = [(a.get("name") or "file", a.get("text") or "") for a in attachments if a.get("kind") == "text"]
-            user_content = build_user_content(content or None, image_data_urls, file_texts)
-            user_message = Message("user", user_content)
-
-            with connect_db() as conn:
-                init_db(conn)
-                history = get_recent_messages(conn, conversation_id)
-                system_prompt = build_system_prompt(conn, content or "Attachment upload")
-                messages = [Message("system", system_prompt), *history, user_message]
-                response_text = call_openai(messages)
-                add_message(conn, conversation_id, user_message)
-                add_message(conn, conversation_id, Message("assistant", response_text))
-            self._send_json({"status": "ok"})
+    def _create_conversation(self) -> None:
+        with pooled_connection() as conn:
+            conversation_id, title = create_conversation(conn)
+        invalidate_payloads("conversations")
+        self._publish({"type": "conversation", "conversation": {"id": conversation_id, "title": title}})
+        self._send_json({"id": conversation_id})
+
+    def _send_message(self) -> None:
+        send_request = self._read_send_request()
+        if send_request is None:
             return
+        with pooled_connection() as conn:
+            response_text, message_ids = reply_to_message(conn, *send_request)
+        invalidate_payloads(f"conversation:{send_request[0]}")
+        self._publish_turn(send_request, response_text, message_ids)
+        self._send_json_bytes(_OK_JSON)
 
-        if parsed.path == "/api/memories":
-            payload = self._read_json()
-            content = payload.get("content")
-            if not content:
-                self._send_text("Missing memory content", HTTPStatus.BAD_REQUEST)
-                return
-            with connect_db() as conn:
-                init_db(conn)
-                add_memory(conn, content)
-            self._send_json({"status": "ok"})
+    def _stream_message(self) -> None:
+        send_request = self._read_send_request()
+        if send_request is None:
+            return
+        self._start_event_stream()
+        _, _, user_message = send_request
+        try:
+            self._send_event({"user": summarize_content(user_message.content)})
+            with pooled_connection() as conn:
+                response_text, message_ids = reply_to_message(
+                    conn, *send_request, on_delta=lambda delta: self._send_event({"delta": delta})
+                )
+            invalidate_payloads(f"conversation:{send_request[0]}")
+            self._publish_turn(send_request, response_text, message_ids)
+        except Exception as exc:
+            try:
+                self._send_event({"error": str(exc)})
+            except OSError:
+                pass  # the client went away; the turn was rolled back with it
             return
+        self._send_event({"done": True, "ids": message_ids})
 
-        if parsed.path == "/api/title":
-            payload = self._read_json()
-            conversation_id = payload.get("conversation_id")
-            title = payload.get("title")
-            if not conversation_id or title is None:
-                self._send_text("Missing conversation_id or title", HTTPStatus.BAD_REQUEST)
-                return
-            with connect_db() as conn:
-                init_db(conn)
-                updated = update_conversation_title(conn, conversation_id, title)
-            self._send_json({"updated": updated})
+    def _upload(self) -> None:
+        # The body is the raw file, so images skip the base64 + JSON round trip.
+        if self._unread_body > MAX_UPLOAD_BYTES:
+            self.close_connection = True
+            self._send_text("Upload too large", HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+            self._unread_body = 0
             return
+        mime_type = self.headers.get("Content-Type") or "application/octet-stream"
+        name = unquote(self.headers.get("X-File-Name", ""))
+        upload_id = store_upload(mime_type, self._read_body())
+        self._send_json({"id": upload_id, "name": name})
 
-        self._send_text("Not found", status=HTTPStatus.NOT_FOUND)
+    def _add_memory(self) -> None:
+        payload = self._read_json()
+        content = payload.get("content")
+        if not content:
+            self._send_text("Missing memory content", HTTPStatus.BAD_REQUEST)
+            return
+        with pooled_connection() as conn:
+            memory_id, content, created_at = add_memory(conn, content)
+        invalidate_payloads("memories")
+        memory = {"id": memory_id, "content": content, "created_at": created_at}
+        self._publish({"type": "memory", "memory": memory})
+        self._send_json({"status": "ok", "memory": memory})
 
-    def do_DELETE(self) -> None:
-        parsed = urlparse(self.path)
-        if parsed.path == "/api/memories":
-            with connect_db() as conn:
-                init_db(conn)
-                clear_memories(conn)
-            self._send_json({"status": "ok"})
+    def _update_title(self) -> None:
+        payload = self._read_json()
+        conversation_id = payload.get("conversation_id")
+        title = payload.get("title")
+        if not conversation_id or title is None:
+            self._send_text("Missing conversation_id or title", HTTPStatus.BAD_REQUEST)
             return
+        with pooled_connection() as conn:
+            updated = update_conversation_title(conn, conversation_id, title)
+        invalidate_payloads("conversations", f"conversation:{conversation_id}")
+        if updated:
+            self._publish({"type": "title", "conversation_id": conversation_id, "title": title})
+        self._send_json_bytes(_UPDATED_JSON[updated])
 
-        if parsed.path.startswith("/api/memories/"):
-            memory_id = parsed.path.split("/")[-1]
-            try:
-                memory_id_int = int(memory_id)
-            except ValueError:
-                self._send_text("Invalid memory id", HTTPStatus.BAD_REQUEST)
-                return
-            with connect_db() as conn:
-                init_db(conn)
-                deleted = delete_memory(conn, memory_id_int)
-            self._send_json({"deleted": deleted})
+    def _clear_memories(self) -> None:
+        with pooled_connection() as conn:
+            clear_memories(conn)
+        invalidate_payloads("memories")
+        self._publish({"type": "memories_cleared"})
+        self._send_json_bytes(_OK_JSON)
+
+    def _delete_memory(self, memory_id: str) -> None:
+        try:
+            memory_id_int = int(memory_id)
+        except ValueError:
+            self._send_text("Invalid memory id", HTTPStatus.BAD_REQUEST)
             return
+        with pooled_connection() as conn:
+            deleted = delete_memory(conn, memory_id_int)
+        invalidate_payloads("memories")
+        if deleted:
+            self._publish({"type": "memory_deleted", "id": memory_id_int})
+        self._send_json_bytes(_DELETED_JSON[deleted])
+
+    # Exact paths are a dict lookup; /api/<collection>/<id> paths are split by
+    # one regex match and routed on the collection.
+    _GET_ROUTES = {
+        "/": _serve_index,
+        "/api/conversations": _list_conversations,
+        "/api/memories": _list_memories,
+        "/api/events": _stream_events,
+    }
+    _GET_ID_ROUTES = {"conversations": _get_conversation}
+    _POST_ROUTES = {
+        "/api/conversations": _create_conversation,
+        "/api/send": _send_message,
+        "/api/send_stream": _stream_message,
+        "/api/upload": _upload,
+        "/api/memories": _add_memory,
+        "/api/title": _update_title,
+    }
+    _DELETE_ROUTES = {"/api/memories": _clear_memories}
+    _DELETE_ID_ROUTES = {"memories": _delete_memory}
+
+    def _dispatch(
+        self,
+        routes: Dict[str, Callable[..., None]],
+        id_routes: Optional[Dict[str, Callable[..., None]]] = None,
+    ) -> None:
+        self._unread_body = int(self.headers.get("Content-Length") or 0)
+        path = urlparse(self.path).path
+        handler = routes.get(path)
+        if handler is not None:
+            handler(self)
+        else:
+            match = _ID_ROUTE_RE.match(path) if id_routes else None
+            handler = id_routes.get(match.group(1)) if match else None
+            if handler is not None:
+                handler(self, match.group(2))
+            else:
+                self._send_text("Not found", status=HTTPStatus.NOT_FOUND)
+        if self._unread_body:
+            # Drain a body nobody read, or it would be parsed as the next request.
+            self._read_body()
+
+    def do_GET(self) -> None:
+        self._dispatch(self._GET_ROUTES, self._GET_ID_ROUTES)
+
+    def do_POST(self) -> None:
+        self._dispatch(self._POST_ROUTES)
 
-        self._send_text("Not found", status=HTTPStatus.NOT_FOUND)
+    def do_DELETE(self) -> None:
+        self._dispatch(self._DELETE_ROUTES, self._DELETE_ID_ROUTES)
 
 
 def main() -> None:
     load_env_file(ENV_PATH)
-    with connect_db() as conn:
+    with pooled_connection() as conn:
         init_db(conn)
-    server = HTTPServer((HOST, PORT), ChatHandler)
+    # One thread per client so a slow /api/send doesn't stall the list endpoints.
+    server = ThreadingHTTPServer((HOST, PORT), ChatHandler)
+    server.daemon_threads = True
     print(f"Web app running on http://{HOST}:{PORT}")
     try:
         server.serve_forever()